@@ -1,20 +1,4 @@
-import subprocess
-import sys
-import os
-
-def install_requirements():
-    requirements_path = os.path.join(os.path.dirname(__file__), "requirements.txt")
-    if os.path.exists(requirements_path):
-        print("正在安装依赖...")
-        subprocess.check_call([
-            sys.executable, 
-            "-m", 
-            "pip", 
-            "install", 
-            "-r", 
-            requirements_path
-        ])
-        print("依赖安装完成")
-
-install_requirements()
+from .bootstrap import ensure_requirements
 
+# 依赖与上次记录一致时只做几次元数据查询，不会启动 pip
+ensure_requirements()
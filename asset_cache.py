@@ -0,0 +1,173 @@
+import time
+import asyncio
+import hashlib
+from urllib.parse import urlsplit
+from .file_cache import IndexedFileCache
+
+
+# 只缓存静态资源，文档本身仍走网络以拿到最新的页面结构
+CACHEABLE_RESOURCE_TYPES = {'script', 'stylesheet', 'image', 'font', 'media', 'fetch', 'xhr'}
+CACHEABLE_EXTENSIONS = ('.js', '.css', '.png', '.jpg', '.jpeg', '.webp', '.gif', '.svg',
+                        '.woff', '.woff2', '.ttf', '.json')
+BLOCKED_HOST_KEYWORDS = ('google-analytics', 'googletagmanager', 'doubleclick', 'hm.baidu.com',
+                         'cnzz', 'clarity.ms', 'googlesyndication', 'adservice')
+# 不转发给上游的响应头
+HOP_BY_HOP_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection'}
+
+
+class RenderTraffic:
+    """单次渲染的流量统计"""
+
+    def __init__(self):
+        self.network_bytes = 0
+        self.network_requests = 0
+        self.cache_bytes = 0
+        self.cache_hits = 0
+        self.revalidated = 0
+        self.blocked = 0
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, values):
+        traffic = cls()
+        traffic.__dict__.update(values)
+        return traffic
+
+    def merge(self, other):
+        """累加另一份统计，用于汇总渲染子进程上报的流量"""
+        for name, value in other.__dict__.items():
+            setattr(self, name, getattr(self, name, 0) + value)
+
+
+class AssetCache(IndexedFileCache):
+    """渲染用的本地 HTTP 资源缓存，在导航前通过 context.route 安装"""
+
+    DESCRIPTION = '资源缓存'
+
+    def __init__(self, cache_dir, allowed_hosts=('homdgcat.wiki',), max_age_seconds=6 * 3600,
+                 max_total_mb=256, logger=None):
+        super().__init__(cache_dir, max_total_mb=max_total_mb, logger=logger)
+        self.allowed_hosts = tuple(allowed_hosts)
+        self.max_age_seconds = max_age_seconds
+        self.totals = RenderTraffic()
+
+    def _key(self, url):
+        # 去掉片段标识，#_<id> 不影响资源内容
+        return hashlib.sha1(url.split('#', 1)[0].encode('utf-8')).hexdigest()
+
+    def _is_allowed_host(self, host):
+        return any(host == allowed or host.endswith('.' + allowed) for allowed in self.allowed_hosts)
+
+    def _is_blocked(self, host):
+        return not self._is_allowed_host(host) or any(k in host for k in BLOCKED_HOST_KEYWORDS)
+
+    def _is_cacheable(self, request):
+        if request.method != 'GET':
+            return False
+        if request.resource_type in CACHEABLE_RESOURCE_TYPES:
+            return True
+        return urlsplit(request.url).path.lower().endswith(CACHEABLE_EXTENSIONS)
+
+    def _read_body(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _store(self, key, url, status, headers, body):
+        self._put(key, body, {
+            'url': url,
+            'status': status,
+            'headers': {k: v for k, v in headers.items() if k.lower() not in HOP_BY_HOP_HEADERS},
+            'etag': headers.get('etag'),
+            'last_modified': headers.get('last-modified'),
+            'size': len(body),
+            'stored_at': time.time(),
+        })
+
+    async def install(self, context):
+        """在浏览器上下文上安装路由，必须在 page.goto 之前调用；返回本次渲染的流量统计"""
+        traffic = RenderTraffic()
+
+        async def handle(route):
+            try:
+                await self._handle(route, traffic)
+            except Exception as e:
+                self.logger.warning(f"资源路由处理失败，回退到网络: {e}")
+                try:
+                    await route.continue_()
+                except Exception:
+                    pass
+
+        await context.route('**/*', handle)
+        return traffic
+
+    async def _handle(self, route, traffic):
+        request = route.request
+        host = urlsplit(request.url).hostname or ''
+        if request.url.startswith(('data:', 'blob:')):
+            await route.continue_()
+            return
+        if self._is_blocked(host):
+            traffic.blocked += 1
+            self.totals.blocked += 1
+            await route.abort()
+            return
+        if not self._is_cacheable(request):
+            await route.continue_()
+            return
+
+        loop = asyncio.get_event_loop()
+        key = self._key(request.url)
+        entry = self.index.get(key)
+        body = await loop.run_in_executor(None, self._read_body, key) if entry else None
+
+        if entry and body is not None and time.time() - entry['stored_at'] < self.max_age_seconds:
+            self._count_cache(traffic, len(body))
+            await route.fulfill(status=entry['status'], headers=entry['headers'], body=body)
+            return
+
+        # 过期或未缓存：带上校验器向上游发起请求
+        headers = dict(request.headers)
+        if entry and body is not None:
+            if entry.get('etag'):
+                headers['if-none-match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['if-modified-since'] = entry['last_modified']
+        response = await route.fetch(headers=headers)
+
+        if response.status == 304 and entry and body is not None:
+            with self._lock:
+                entry['stored_at'] = time.time()
+            traffic.revalidated += 1
+            self.totals.revalidated += 1
+            self._count_cache(traffic, len(body))
+            await route.fulfill(status=entry['status'], headers=entry['headers'], body=body)
+            return
+
+        fetched = await response.body()
+        traffic.network_requests += 1
+        traffic.network_bytes += len(fetched)
+        self.totals.network_requests += 1
+        self.totals.network_bytes += len(fetched)
+        if response.status == 200:
+            await loop.run_in_executor(
+                None, self._store, key, request.url, response.status, response.headers, fetched
+            )
+        await route.fulfill(response=response, body=fetched)
+
+    def _count_cache(self, traffic, size):
+        traffic.cache_hits += 1
+        traffic.cache_bytes += size
+        self.totals.cache_hits += 1
+        self.totals.cache_bytes += size
+
+    def stats(self):
+        return {
+            "entries": len(self.index),
+            "bytes": self.total_bytes,
+            **self.totals.as_dict(),
+        }
@@ -0,0 +1,281 @@
+"""离线基准测试：用本地 HTTP 服务替代 homdgcat.wiki，测量渲染链路的延迟与吞吐
+
+在 QChatGPT 根目录下运行（需要能导入 pkg 与插件包）：
+
+    python -m plugins.<插件目录>.benchmarks.bench --concurrency 8
+"""
+import os
+import sys
+import time
+import json
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+from ..fetch_characters import CharacterDataManager
+from ..character_index import CharacterIndex
+from ..browser_pool import process_tree_rss
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+class _FixtureHandler(SimpleHTTPRequestHandler):
+    """按原站的路径提供夹具文件，/sr/char 映射到 sr/char.html"""
+
+    def translate_path(self, path):
+        path = path.split('?', 1)[0].split('#', 1)[0]
+        if path.rstrip('/') == '/sr/char':
+            path = '/sr/char.html'
+        return super().translate_path(path)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer:
+    """在后台线程中运行的本地站点替身"""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        handler = partial(_FixtureHandler, directory=FIXTURES_DIR)
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.host = host
+        self.port = self.httpd.server_address[1]
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class RssSampler:
+    """周期采样本进程及所有子进程（浏览器）的内存，记录峰值"""
+
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self.peak_bytes = 0
+        self._task = None
+
+    def _sample(self):
+        with open('/proc/self/statm', 'r') as f:
+            own = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        return own + (process_tree_rss() or 0)
+
+    async def _run(self):
+        while True:
+            try:
+                self.peak_bytes = max(self.peak_bytes, self._sample())
+            except OSError:
+                # 非 Linux 平台退回到 getrusage 的峰值
+                import resource
+                usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+                self.peak_bytes = max(self.peak_bytes, usage)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(samples):
+    """把 {阶段: [耗时, ...]} 汇总为 p50/p95（毫秒）"""
+    return {
+        stage: {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+        }
+        for stage, values in samples.items()
+    }
+
+
+def collect_stages(renders):
+    samples = {}
+    for timings in renders:
+        for stage, value in timings.items():
+            samples.setdefault(stage, []).append(value)
+    return samples
+
+
+async def timed(coro):
+    start = time.perf_counter()
+    result = await coro
+    return result, time.perf_counter() - start
+
+
+async def bench_index(server, work_dir, lookups):
+    """角色索引：冷启动拉取、磁盘恢复与内存查找"""
+    cache_path = os.path.join(work_dir, 'avatar_index.json')
+    url = f"{server.base_url}/data/CH/Avatar.js"
+
+    index = CharacterIndex(cache_path, url=url)
+    _, cold = await timed(index.refresh())
+    names = list(index.by_name)
+
+    start = time.perf_counter()
+    restored = CharacterIndex(cache_path, url=url)
+    restore = time.perf_counter() - start
+
+    lookup_times = []
+    for i in range(lookups):
+        _, elapsed = await timed(restored.get_id(names[i % len(names)]))
+        lookup_times.append(elapsed)
+
+    return {
+        "cold_fetch_ms": round(cold * 1000, 1),
+        "disk_restore_ms": round(restore * 1000, 2),
+        "lookup": summarize({"index_lookup": lookup_times})["index_lookup"],
+    }, index
+
+
+async def bench_cold_miss(manager, characters):
+    """每个角色首次请求：完整渲染"""
+    manager.recent_renders.clear()
+    latencies = []
+    for char_id, name in characters:
+        result, elapsed = await timed(manager.get_character_snapshot(char_id, name))
+        if result is None:
+            raise RuntimeError(f"角色 {char_id} 渲染失败")
+        latencies.append(elapsed)
+    stages = collect_stages(manager.recent_renders)
+    stages["request"] = latencies
+    return summarize(stages)
+
+
+async def bench_warm_hit(manager, characters, rounds):
+    """内存命中与磁盘命中"""
+    memory = []
+    for _ in range(rounds):
+        for char_id, name in characters:
+            _, elapsed = await timed(manager.get_character_snapshot(char_id, name))
+            memory.append(elapsed)
+
+    disk = []
+    for char_id, name in characters:
+        manager.memory_cache.invalidate(str(char_id))
+        _, elapsed = await timed(manager.get_character_snapshot(char_id, name))
+        disk.append(elapsed)
+    return summarize({"memory_hit": memory, "disk_hit": disk})
+
+
+async def bench_concurrent(manager, characters, concurrency):
+    """清空缓存后同时发起 N 个请求，包含重复角色以覆盖合并渲染"""
+    for char_id, _ in characters:
+        manager.memory_cache.invalidate(str(char_id))
+        manager.snapshot_store.remove(char_id)
+    manager.recent_renders.clear()
+
+    jobs = [characters[i % len(characters)] for i in range(concurrency)]
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        timed(manager.get_character_snapshot(char_id, name)) for char_id, name in jobs
+    ))
+    elapsed = time.perf_counter() - start
+
+    renders = len(manager.recent_renders)
+    stages = collect_stages(manager.recent_renders)
+    stages["request"] = [latency for _, latency in results]
+    return {
+        "requests": concurrency,
+        "renders": renders,
+        "failed": sum(1 for image, _ in results if image is None),
+        "wall_s": round(elapsed, 2),
+        "renders_per_minute": round(renders / elapsed * 60, 1) if elapsed else 0.0,
+        "stages": summarize(stages),
+    }
+
+
+async def run(args):
+    work_dir = tempfile.mkdtemp(prefix='sr-bench-')
+    sampler = RssSampler()
+    sampler.start()
+    report = {}
+    try:
+        with FixtureServer() as server:
+            report["index"], index = await bench_index(server, work_dir, args.lookups)
+            characters = [(index.by_name[name], name) for name in list(index.by_name)[:args.characters]]
+
+            manager = CharacterDataManager(
+                pool_size=args.pool_size,
+                base_url=f"{server.base_url}/sr/char",
+                data_dir=work_dir,
+                asset_allowed_hosts=(server.host,)
+            )
+            try:
+                _, startup = await timed(manager.start())
+                report["browser_startup_ms"] = round(startup * 1000, 1)
+                report["cold_miss"] = await bench_cold_miss(manager, characters)
+                report["warm_hit"] = await bench_warm_hit(manager, characters, args.rounds)
+                report["concurrent"] = await bench_concurrent(manager, characters, args.concurrency)
+                report["asset_cache"] = manager.asset_cache.stats()
+            finally:
+                await manager.close()
+    finally:
+        await sampler.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    report["peak_rss_mb"] = round(sampler.peak_bytes / 1024 / 1024, 1)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="StarRailCharacterFetcher 离线基准测试")
+    parser.add_argument('--characters', type=int, default=4, help="参与测试的角色数")
+    parser.add_argument('--rounds', type=int, default=20, help="缓存命中场景的轮数")
+    parser.add_argument('--concurrency', type=int, default=8, help="并发场景的请求数")
+    parser.add_argument('--pool-size', type=int, default=1, help="浏览器池大小")
+    parser.add_argument('--lookups', type=int, default=1000, help="索引查找次数")
+    parser.add_argument('--json', action='store_true', help="以 JSON 输出报告")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    if args.json:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        return
+
+    print(f"\n浏览器池启动: {report['browser_startup_ms']}ms，峰值内存: {report['peak_rss_mb']}MB")
+    print(f"角色索引: 冷启动 {report['index']['cold_fetch_ms']}ms，"
+          f"磁盘恢复 {report['index']['disk_restore_ms']}ms，"
+          f"查找 p50 {report['index']['lookup']['p50_ms']}ms")
+    for scenario in ('cold_miss', 'warm_hit'):
+        print(f"\n[{scenario}]")
+        for stage, stats in report[scenario].items():
+            print(f"  {stage:<16} n={stats['count']:<4} p50={stats['p50_ms']:>9}ms  p95={stats['p95_ms']:>9}ms")
+    concurrent = report['concurrent']
+    print(f"\n[concurrent] {concurrent['requests']} 个请求 / {concurrent['renders']} 次渲染，"
+          f"耗时 {concurrent['wall_s']}s，{concurrent['renders_per_minute']} 次渲染/分钟，"
+          f"失败 {concurrent['failed']}")
+    for stage, stats in concurrent['stages'].items():
+        print(f"  {stage:<16} n={stats['count']:<4} p50={stats['p50_ms']:>9}ms  p95={stats['p95_ms']:>9}ms")
+
+
+if __name__ == '__main__':
+    main()
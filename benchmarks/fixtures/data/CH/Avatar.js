@@ -0,0 +1,11 @@
+var _avatar = [
+{"_id": 1001, "Name": "三月七", "Rarity": 4, "Element": "Ice", "Path": "Preservation"},
+{"_id": 1002, "Name": "丹恒", "Rarity": 4, "Element": "Wind", "Path": "The Hunt"},
+{"_id": 1003, "Name": "姬子", "Rarity": 5, "Element": "Fire", "Path": "Erudition"},
+{"_id": 1004, "Name": "瓦尔特", "Rarity": 5, "Element": "Imaginary", "Path": "Nihility"},
+{"_id": 1102, "Name": "希儿", "Rarity": 5, "Element": "Quantum", "Path": "The Hunt"},
+{"_id": 1205, "Name": "刃", "Rarity": 5, "Element": "Wind", "Path": "Destruction"},
+{"_id": 1212, "Name": "镜流", "Rarity": 5, "Element": "Ice", "Path": "Destruction"},
+{"_id": 1225, "Name": "忘归人", "Rarity": 5, "Element": "Fire", "Path": "Nihility"}
+]
+var _avatar_extra = {}
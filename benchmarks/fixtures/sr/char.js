@@ -0,0 +1,30 @@
+// 模拟原站的行为：根据 #_<id> 异步分批渲染角色区块
+(function () {
+    var id = parseInt(location.hash.replace('#_', ''), 10);
+    var character = (window._avatar || []).filter(function (c) { return c._id === id; })[0]
+        || {_id: id, Name: '未知角色'};
+    var body = document.querySelector('div.mon_body');
+    var titles = ['基础信息', '角色描述', '普攻', '战技', '终结技', '天赋', '秘技', '行迹', '星魂', '光锥推荐', '遗器推荐'];
+    var index = 0;
+
+    function addSection() {
+        var section = document.createElement('div');
+        section.className = 'a_section';
+        var html = '<h3>' + character.Name + ' · ' + titles[index] + '</h3>';
+        if (index % 3 === 0) {
+            html += '<img src="/img/portrait.svg?s=' + index + '">';
+        }
+        for (var i = 0; i < 4; i++) {
+            html += '<p>' + titles[index] + ' 描述文本第 ' + (i + 1) + ' 段，角色ID ' + character._id +
+                '，用于撑开区块高度并模拟真实页面的文字排版开销。</p>';
+        }
+        section.innerHTML = html;
+        body.appendChild(section);
+        index += 1;
+        if (index < titles.length) {
+            setTimeout(addSection, 60);
+        }
+    }
+
+    setTimeout(addSection, 100);
+})();
@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+import hashlib
+import subprocess
+from importlib import metadata
+
+
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+REQUIREMENTS_PATH = os.path.join(PLUGIN_DIR, "requirements.txt")
+MARKER_PATH = os.path.join(PLUGIN_DIR, ".bootstrap.json")
+
+
+def _read_marker():
+    try:
+        with open(MARKER_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_marker(**updates):
+    marker = _read_marker()
+    marker.update(updates)
+    tmp_path = f"{MARKER_PATH}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(marker, f)
+        os.replace(tmp_path, MARKER_PATH)
+    except OSError:
+        pass
+
+
+def _requirements():
+    """读取 requirements.txt 中的包名（忽略版本约束与注释）"""
+    names = []
+    with open(REQUIREMENTS_PATH, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            for sep in ('[', '=', '<', '>', '!', '~', ';', ' '):
+                line = line.split(sep, 1)[0]
+            names.append(line)
+    return names
+
+
+def _requirements_digest():
+    with open(REQUIREMENTS_PATH, 'rb') as f:
+        content = f.read()
+    return hashlib.sha256(content + sys.executable.encode('utf-8')).hexdigest()
+
+
+def _installed_versions(names):
+    """返回 {包名: 版本}，有任一包未安装时返回 None"""
+    versions = {}
+    for name in names:
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            return None
+    return versions
+
+
+def ensure_requirements():
+    """依赖均已安装且 requirements.txt 未变化时直接返回；否则执行一次 pip install 并记录标记"""
+    if not os.path.exists(REQUIREMENTS_PATH):
+        return
+    names = _requirements()
+    digest = _requirements_digest()
+    versions = _installed_versions(names)
+    marker = _read_marker()
+    if versions is not None and marker.get('requirements') == digest:
+        if marker.get('versions') != versions:
+            # 依赖在插件之外被升级或降级，只更新标记
+            _write_marker(versions=versions)
+        return
+
+    # 有依赖缺失，或 requirements.txt 有改动（例如调整了版本约束），都需要重新安装
+    print("正在安装依赖...")
+    subprocess.check_call([
+        sys.executable,
+        "-m",
+        "pip",
+        "install",
+        "-r",
+        REQUIREMENTS_PATH
+    ])
+    print("依赖安装完成")
+    _write_marker(requirements=digest, versions=_installed_versions(names))
+
+
+def _browsers_path():
+    """playwright 浏览器的安装目录，与 playwright 自身的查找规则一致"""
+    custom = os.environ.get('PLAYWRIGHT_BROWSERS_PATH')
+    if custom and custom != '0':
+        return custom
+    if sys.platform.startswith('win'):
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+        return os.path.join(base, 'ms-playwright')
+    if sys.platform == 'darwin':
+        return os.path.expanduser('~/Library/Caches/ms-playwright')
+    return os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'ms-playwright')
+
+
+def firefox_installed():
+    """标记中的 playwright 版本与当前一致，且浏览器目录仍在时视为已安装"""
+    marker = _read_marker()
+    try:
+        version = metadata.version('playwright')
+    except metadata.PackageNotFoundError:
+        return False
+    browsers_path = _browsers_path()
+    if marker.get('firefox_playwright') != version or marker.get('firefox_path') != browsers_path:
+        return False
+    try:
+        return any(name.startswith('firefox') for name in os.listdir(browsers_path))
+    except OSError:
+        return False
+
+
+def mark_firefox_installed():
+    try:
+        version = metadata.version('playwright')
+    except metadata.PackageNotFoundError:
+        return
+    _write_marker(firefox_playwright=version, firefox_path=_browsers_path())
+
+
+def invalidate_firefox():
+    """浏览器无法启动时清除标记，下次启动重新安装"""
+    _write_marker(firefox_playwright=None, firefox_path=None)
+
+
+def install_firefox():
+    """执行 playwright install firefox，成功后写入标记"""
+    result = subprocess.run(
+        [sys.executable, '-m', 'playwright', 'install', 'firefox'],
+        capture_output=True,
+        text=True
+    )
+    if result.returncode == 0:
+        mark_firefox_installed()
+    return result
+
+
+def install_firefox_deps():
+    return subprocess.run(
+        [sys.executable, '-m', 'playwright', 'install-deps', 'firefox'],
+        capture_output=True,
+        text=True
+    )
@@ -0,0 +1,273 @@
+import os
+import logging
+import time
+import asyncio
+from contextlib import asynccontextmanager
+
+
+FIREFOX_ARGS = [
+    '--no-sandbox',
+    '--disable-gpu',
+    '--disable-dev-shm-usage'
+]
+
+
+def process_descendants(root_pid):
+    """列出指定进程的所有子孙进程ID；非 Linux 平台返回 None"""
+    if not os.path.isdir('/proc'):
+        return None
+
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as f:
+                stat = f.read()
+            # 进程名可能包含空格和括号，从最后一个 ')' 之后开始解析
+            fields = stat[stat.rfind(')') + 2:].split()
+            parents[int(entry)] = int(fields[1])
+        except (OSError, IndexError, ValueError):
+            continue
+
+    descendants = set()
+    frontier = [root_pid]
+    while frontier:
+        pid = frontier.pop()
+        for child, parent in parents.items():
+            if parent == pid and child not in descendants:
+                descendants.add(child)
+                frontier.append(child)
+    return descendants
+
+
+def process_tree_rss(root_pid=None, include_root=False):
+    """统计指定进程所有子孙进程的常驻内存（字节），默认不含自身；非 Linux 平台返回 None"""
+    root_pid = root_pid or os.getpid()
+    descendants = process_descendants(root_pid)
+    if descendants is None:
+        return None
+    if include_root:
+        descendants.add(root_pid)
+
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    total = 0
+    for pid in descendants:
+        try:
+            with open(f'/proc/{pid}/statm', 'r') as f:
+                total += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+class _BrowserSlot:
+    """池中的一个浏览器实例及其使用统计"""
+
+    def __init__(self, index):
+        self.index = index
+        self.browser = None
+        self.renders = 0
+        self.launched_at = None
+        self.active = 0                 # 正在使用该浏览器的上下文数
+        self.pending_recycle = None     # 待回收的原因，等所有上下文结束后执行
+        self.held = 0                   # 等待回收期间扣下的借用名额
+
+
+class BrowserPool:
+    """常驻的 Firefox 浏览器池，每次渲染分配一个独立的 BrowserContext
+
+    contexts_per_browser 大于 1 时同一个浏览器可同时承载多个上下文，
+    批量渲染时不必为每路并发各启动一个浏览器。
+    """
+
+    def __init__(self, size=1, max_renders_per_browser=50, max_rss_mb=1536,
+                 launch_timeout=30000, contexts_per_browser=1, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.size = max(1, int(size))
+        self.contexts_per_browser = max(1, int(contexts_per_browser))
+        self.max_renders_per_browser = max_renders_per_browser
+        self.max_rss_mb = max_rss_mb
+        self.launch_timeout = launch_timeout
+        self._playwright = None
+        self._slots = []
+        self._idle = None
+        self._start_lock = asyncio.Lock()
+        self.started = False
+        self.recycled = 0
+        self.waiting = 0  # 正在等待空闲浏览器的渲染数
+
+    async def start(self):
+        """启动 playwright 并预先拉起所有浏览器实例，重复调用无副作用"""
+        async with self._start_lock:
+            if self.started:
+                return
+            # 首次渲染时才导入 playwright，避免拖慢插件加载
+            from playwright.async_api import async_playwright
+            self._playwright = await async_playwright().start()
+            self._idle = asyncio.Queue()
+            self._slots = [_BrowserSlot(i) for i in range(self.size)]
+            try:
+                for slot in self._slots:
+                    await self._launch(slot)
+                    # 每个浏览器按可同时承载的上下文数放入对应数量的借用名额
+                    for _ in range(self.contexts_per_browser):
+                        self._idle.put_nowait(slot)
+            except Exception:
+                await self._shutdown()
+                raise
+            self.started = True
+            self.logger.info(f"浏览器池已启动，共 {self.size} 个实例，"
+                             f"每个实例最多 {self.contexts_per_browser} 个并发上下文")
+
+    async def close(self):
+        """关闭所有浏览器实例并停止 playwright"""
+        async with self._start_lock:
+            if not self.started:
+                return
+            self.started = False
+            await self._shutdown()
+            self.logger.info("浏览器池已关闭")
+
+    async def _shutdown(self):
+        for slot in self._slots:
+            await self._close_browser(slot)
+        self._slots = []
+        if self._playwright:
+            try:
+                await self._playwright.stop()
+            except Exception as e:
+                self.logger.error(f"停止 playwright 时出错: {e}")
+            self._playwright = None
+
+    async def _launch(self, slot):
+        launch_start = time.time()
+        slot.browser = await self._playwright.firefox.launch(
+            headless=True,
+            args=FIREFOX_ARGS,
+            timeout=self.launch_timeout
+        )
+        slot.renders = 0
+        slot.launched_at = time.time()
+        self.logger.info(f"浏览器实例 #{slot.index} 启动耗时: {time.time() - launch_start:.2f}秒")
+
+    async def _close_browser(self, slot):
+        if slot.browser is None:
+            return
+        try:
+            await slot.browser.close()
+        except Exception as e:
+            self.logger.error(f"关闭浏览器实例 #{slot.index} 时出错: {e}")
+        slot.browser = None
+
+    async def _recycle(self, slot, reason):
+        self.logger.info(f"回收浏览器实例 #{slot.index}: {reason}")
+        await self._close_browser(slot)
+        await self._launch(slot)
+        self.recycled += 1
+
+    def _is_healthy(self, slot):
+        return slot.browser is not None and slot.browser.is_connected()
+
+    def _over_memory_limit(self):
+        if not self.max_rss_mb:
+            return False
+        rss = process_tree_rss()
+        return rss is not None and rss > self.max_rss_mb * 1024 * 1024
+
+    async def _recycle_pending(self, slot):
+        """执行待定的回收，并放回回收期间扣下的借用名额；调用方须已占用该浏览器"""
+        try:
+            await self._recycle(slot, slot.pending_recycle)
+        finally:
+            slot.pending_recycle = None
+            held, slot.held = slot.held, 0
+            if self.started:
+                for _ in range(held):
+                    self._idle.put_nowait(slot)
+
+    async def _acquire(self):
+        """取得一个借用名额；浏览器待回收时扣下名额，等其上的上下文全部结束"""
+        while True:
+            slot = await self._idle.get()
+            if slot.pending_recycle is None and not self._is_healthy(slot):
+                slot.pending_recycle = "健康检查失败"
+            if slot.pending_recycle is None:
+                slot.active += 1
+                return slot
+            if slot.active == 0:
+                # 先占用再回收，其他协程拿到同一浏览器的名额时会把名额扣下
+                slot.active += 1
+                try:
+                    await self._recycle_pending(slot)
+                except Exception:
+                    slot.active -= 1
+                    self._idle.put_nowait(slot)
+                    raise
+                return slot
+            slot.held += 1
+
+    async def _release(self, slot):
+        slot.active -= 1
+        if not self.started:
+            return
+        if slot.pending_recycle is None:
+            if self.max_renders_per_browser and slot.renders >= self.max_renders_per_browser:
+                slot.pending_recycle = f"已渲染 {slot.renders} 次"
+            elif self._over_memory_limit():
+                slot.pending_recycle = f"内存超过 {self.max_rss_mb}MB"
+        if slot.pending_recycle is not None:
+            if slot.active > 0:
+                # 还有其他上下文在使用该浏览器，由最后一个结束的上下文执行回收
+                slot.held += 1
+                return
+            slot.active += 1
+            try:
+                await self._recycle_pending(slot)
+            finally:
+                slot.active -= 1
+                if self.started:
+                    self._idle.put_nowait(slot)
+            return
+        self._idle.put_nowait(slot)
+
+    @asynccontextmanager
+    async def context(self, **context_options):
+        """借出一个浏览器实例并为本次渲染创建独立的上下文，用完自动归还"""
+        if not self.started:
+            await self.start()
+
+        self.waiting += 1
+        try:
+            slot = await self._acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            context = await slot.browser.new_context(**context_options)
+            try:
+                yield context
+            finally:
+                try:
+                    await context.close()
+                except Exception as e:
+                    self.logger.error(f"关闭浏览器上下文时出错: {e}")
+                slot.renders += 1
+        finally:
+            await self._release(slot)
+
+    def rss_bytes(self):
+        """浏览器进程的总常驻内存；需要扫描 /proc，可在线程池中调用"""
+        return process_tree_rss()
+
+    def stats(self, include_rss=True):
+        """返回浏览器池的当前状态；include_rss 为 False 时不扫描进程内存"""
+        return {
+            "size": self.size,
+            "contexts_per_browser": self.contexts_per_browser,
+            "active": [slot.active for slot in self._slots],
+            "idle": self._idle.qsize() if self._idle else 0,
+            "waiting": self.waiting,
+            "renders": [slot.renders for slot in self._slots],
+            "recycled": self.recycled,
+            "rss_bytes": self.rss_bytes() if include_rss else None,
+        }
@@ -0,0 +1,236 @@
+import os
+import re
+import logging
+
+
+# 常见系统中的中文字体，找到第一个存在的即可
+FONT_CANDIDATES = (
+    '/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/google-noto-cjk/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/truetype/wqy/wqy-microhei.ttc',
+    '/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc',
+    '/usr/share/fonts/wqy-microhei/wqy-microhei.ttc',
+    '/System/Library/Fonts/PingFang.ttc',
+    '/System/Library/Fonts/STHeiti Medium.ttc',
+    'C:/Windows/Fonts/msyh.ttc',
+    'C:/Windows/Fonts/simhei.ttf',
+)
+
+ELEMENTS = {
+    'Physical': ('物理', (150, 150, 150)),
+    'Fire': ('火', (226, 80, 64)),
+    'Ice': ('冰', (64, 160, 220)),
+    'Thunder': ('雷', (170, 90, 210)),
+    'Lightning': ('雷', (170, 90, 210)),
+    'Wind': ('风', (80, 190, 150)),
+    'Quantum': ('量子', (90, 80, 200)),
+    'Imaginary': ('虚数', (220, 190, 60)),
+}
+
+PATHS = {
+    'Warrior': '毁灭', 'Destruction': '毁灭',
+    'Rogue': '巡猎', 'The Hunt': '巡猎', 'Hunt': '巡猎',
+    'Mage': '智识', 'Erudition': '智识',
+    'Shaman': '同谐', 'Harmony': '同谐',
+    'Warlock': '虚无', 'Nihility': '虚无',
+    'Knight': '存护', 'Preservation': '存护',
+    'Priest': '丰饶', 'Abundance': '丰饶',
+    'Memory': '记忆', 'Remembrance': '记忆',
+}
+
+# 基本信息中展示的字段及其中文标签，未列出的标量字段按原字段名展示
+FIELD_LABELS = {
+    'Rarity': '稀有度',
+    'Element': '属性',
+    'Damage': '属性',
+    'Path': '命途',
+    'BaseType': '命途',
+    'Faction': '阵营',
+    'Camp': '阵营',
+    'CV_CN': '中文配音',
+    'CV_JP': '日文配音',
+    'Version': '实装版本',
+}
+NAME_KEYS = ('Name', 'AvatarName')
+DESC_KEYS = ('Desc', 'Description', 'Intro', 'AvatarDesc')
+SKILL_KEYS = ('Skills', 'SkillList', 'Skill')
+HIDDEN_KEYS = {'_id', 'Icon', 'Image', 'Portrait'}
+
+MARKUP_RE = re.compile(r'<[^>]+>')
+
+
+class CardRenderError(Exception):
+    """无法生成角色卡片（缺少数据或中文字体）"""
+
+
+def clean_text(text):
+    """去掉富文本标记，把转义的换行还原"""
+    text = MARKUP_RE.sub('', str(text))
+    return text.replace('\\n', '\n').replace('{NICKNAME}', '开拓者').strip()
+
+
+def _first(character, keys):
+    for key in keys:
+        value = character.get(key)
+        if value not in (None, '', [], {}):
+            return key, value
+    return None, None
+
+
+class CharacterCardRenderer:
+    """不启动浏览器，直接由 Avatar.js 中的结构化数据用 PIL 绘制角色卡片"""
+
+    def __init__(self, width=600, font_path=None, padding=28, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.width = width
+        self.padding = padding
+        self.font_path = font_path
+        self._fonts = {}
+        self._widths = {}
+
+    def find_font(self):
+        """返回可用的中文字体路径，找不到时返回 None"""
+        if self.font_path:
+            return self.font_path if os.path.exists(self.font_path) else None
+        for path in FONT_CANDIDATES:
+            if os.path.exists(path):
+                self.font_path = path
+                return path
+        return None
+
+    @property
+    def available(self):
+        return self.find_font() is not None
+
+    def _font(self, size):
+        font = self._fonts.get(size)
+        if font is None:
+            path = self.find_font()
+            if path is None:
+                raise CardRenderError("未找到可用的中文字体，请在配置中指定 card_font_path")
+            from PIL import ImageFont
+            font = self._fonts[size] = ImageFont.truetype(path, size)
+        return font
+
+    def _wrap(self, text, font, max_width):
+        """按像素宽度逐字换行，中英文混排也能正确断行；逐字宽度按字号缓存，避免反复测量整行"""
+        widths = self._widths.setdefault(font.size, {})
+        lines = []
+        for paragraph in text.split('\n'):
+            line = ''
+            line_width = 0
+            for char in paragraph:
+                width = widths.get(char)
+                if width is None:
+                    width = widths[char] = font.getlength(char)
+                if line and line_width + width > max_width:
+                    lines.append(line)
+                    line = char.lstrip()
+                    line_width = width if line else 0
+                else:
+                    line += char
+                    line_width += width
+            lines.append(line)
+        return lines
+
+    def _blocks(self, character):
+        """把角色数据整理为 (类型, 内容) 的绘制块"""
+        blocks = []
+        info = []
+        for key, value in character.items():
+            if key in HIDDEN_KEYS or key in NAME_KEYS or key in DESC_KEYS or key in SKILL_KEYS:
+                continue
+            if isinstance(value, (list, dict)) or value in (None, ''):
+                continue
+            if key in ('Element', 'Damage'):
+                value = ELEMENTS.get(value, (value,))[0]
+            elif key in ('Path', 'BaseType'):
+                value = PATHS.get(value, value)
+            elif key == 'Rarity':
+                value = '★' * int(value) if str(value).isdigit() else value
+            info.append(f"{FIELD_LABELS.get(key, key)}：{clean_text(value)}")
+        if info:
+            blocks.append(('heading', '基本信息'))
+            blocks.extend(('text', line) for line in info)
+
+        _, desc = _first(character, DESC_KEYS)
+        if desc:
+            blocks.append(('heading', '角色描述'))
+            blocks.append(('text', clean_text(desc)))
+
+        _, skills = _first(character, SKILL_KEYS)
+        if isinstance(skills, dict):
+            skills = list(skills.values())
+        if skills:
+            blocks.append(('heading', '技能'))
+            for skill in skills:
+                if not isinstance(skill, dict):
+                    blocks.append(('text', clean_text(skill)))
+                    continue
+                _, name = _first(skill, ('Name', 'SkillName'))
+                _, tag = _first(skill, ('Tag', 'Type', 'SkillType', 'TypeDesc'))
+                title = clean_text(name or '')
+                if tag:
+                    title = f"{title}【{clean_text(tag)}】"
+                if title:
+                    blocks.append(('subheading', title))
+                _, skill_desc = _first(skill, ('Desc', 'Description', 'SimpleDesc'))
+                if skill_desc:
+                    blocks.append(('text', clean_text(skill_desc)))
+        return blocks
+
+    def render(self, character):
+        """绘制角色卡片，返回 RGB 图片；在工作线程中调用"""
+        if not character:
+            raise CardRenderError("缺少角色数据")
+        # 与图片流水线一样，首次绘制时才导入 PIL
+        from PIL import Image, ImageDraw
+
+        fonts = {
+            'title': self._font(40),
+            'subtitle': self._font(22),
+            'heading': self._font(26),
+            'subheading': self._font(22),
+            'text': self._font(20),
+        }
+        line_gap = {'heading': 18, 'subheading': 10, 'text': 8}
+        content_width = self.width - self.padding * 2
+
+        # 先排版计算总高度，再一次性绘制
+        laid_out = []
+        y = 0
+        for kind, content in self._blocks(character):
+            font = fonts[kind]
+            top_margin = line_gap[kind] if laid_out else 0
+            lines = self._wrap(content, font, content_width)
+            line_height = font.size + line_gap['text']
+            laid_out.append((kind, lines, y + top_margin, line_height))
+            y += top_margin + line_height * len(lines)
+
+        element_name, accent = ELEMENTS.get(character.get('Element') or character.get('Damage'),
+                                            (None, (90, 110, 160)))
+        header_height = 130
+        height = header_height + self.padding * 2 + y
+        card = Image.new('RGB', (self.width, height), (248, 248, 250))
+        draw = ImageDraw.Draw(card)
+
+        draw.rectangle((0, 0, self.width, header_height), fill=accent)
+        _, name = _first(character, NAME_KEYS)
+        draw.text((self.padding, 24), clean_text(name or character.get('_id', '')),
+                  font=fonts['title'], fill=(255, 255, 255))
+        subtitle = ' · '.join(str(part) for part in (
+            '★' * int(character['Rarity']) if str(character.get('Rarity', '')).isdigit() else None,
+            element_name,
+            PATHS.get(character.get('Path') or character.get('BaseType')),
+        ) if part)
+        if subtitle:
+            draw.text((self.padding, 82), subtitle, font=fonts['subtitle'], fill=(255, 255, 255))
+
+        top = header_height + self.padding
+        for kind, lines, offset, line_height in laid_out:
+            color = accent if kind == 'heading' else (40, 40, 48)
+            for index, line in enumerate(lines):
+                draw.text((self.padding, top + offset + index * line_height), line,
+                          font=fonts[kind], fill=color)
+        return card
@@ -0,0 +1,181 @@
+import os
+import logging
+import json
+import time
+import asyncio
+import hashlib
+from .name_index import NameIndex, load_aliases
+
+
+AVATAR_JS_URL = "https://homdgcat.wiki/data/CH/Avatar.js"
+
+
+class AvatarParseError(Exception):
+    """Avatar.js 内容无法解析"""
+
+
+def parse_avatar_js(content):
+    """从 Avatar.js 文本中提取 _avatar 数组"""
+    # 定位 _avatar 变量的内容
+    avatar_start = content.find("var _avatar = [")
+    if avatar_start == -1:
+        raise AvatarParseError("未找到 _avatar 变量")
+
+    # 找到下一个变量定义的位置
+    next_var = content.find("var _", avatar_start + 13)  # 跳过当前的 "var _avatar = ["
+    if next_var == -1:
+        next_var = len(content)
+
+    # 向前查找最后一个 "]"
+    avatar_end = content.rfind("]", avatar_start, next_var)
+    if avatar_end == -1:
+        raise AvatarParseError("未找到 _avatar 数组的结束位置")
+
+    # 提取 JSON 数组内容
+    return json.loads(content[avatar_start + 13:avatar_end + 1])
+
+
+class CharacterIndex:
+    """角色索引：异步拉取 Avatar.js，按 TTL 条件请求重新验证，并持久化到磁盘"""
+
+    def __init__(self, cache_path, url=AVATAR_JS_URL, ttl_seconds=3600, request_timeout=15,
+                 aliases_path=None, fuzzy_threshold=0.6, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.cache_path = cache_path
+        self.url = url
+        self.ttl_seconds = ttl_seconds
+        self.request_timeout = request_timeout
+        self.characters = []
+        self.by_name = {}
+        self.by_id = {}
+        self.entry_hashes = {}
+        self.aliases = load_aliases(aliases_path, self.logger) if aliases_path else {}
+        self.fuzzy_threshold = fuzzy_threshold
+        self.name_index = NameIndex([], logger=self.logger)
+        self.etag = None
+        self.last_modified = None
+        self.fetched_at = 0
+        self._refresh_task = None
+        self._load()
+
+    def _load(self):
+        """从磁盘恢复上次解析好的索引，使重启后无需等待网络"""
+        if not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            self.etag = cached.get('etag')
+            self.last_modified = cached.get('last_modified')
+            self.fetched_at = cached.get('fetched_at', 0)
+            self._rebuild(cached.get('characters', []))
+            self.logger.info(f"已从磁盘加载角色索引，共 {len(self.characters)} 个角色")
+        except Exception as e:
+            self.logger.warning(f"读取角色索引缓存失败: {e}")
+
+    def _save(self):
+        tmp_path = f"{self.cache_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'etag': self.etag,
+                    'last_modified': self.last_modified,
+                    'fetched_at': self.fetched_at,
+                    'characters': self.characters,
+                }, f, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_path)
+        except Exception as e:
+            self.logger.warning(f"保存角色索引缓存失败: {e}")
+
+    def _rebuild(self, characters):
+        self.characters = characters
+        self.by_name = {}
+        self.by_id = {}
+        self.entry_hashes = {}
+        for character in characters:
+            char_id = str(character.get('_id', ''))
+            if not char_id:
+                continue
+            self.by_id[char_id] = character
+            self.entry_hashes[char_id] = hashlib.sha1(
+                json.dumps(character, sort_keys=True, ensure_ascii=False).encode('utf-8')
+            ).hexdigest()
+            name = character.get('Name')
+            # 同名角色（如多个开拓者）保留第一个，与原先线性查找的行为一致
+            if name and name not in self.by_name:
+                self.by_name[name] = char_id
+        # 别名、拼音与模糊匹配索引只在数据变化时构建一次
+        self.name_index = NameIndex(
+            characters, aliases=self.aliases,
+            fuzzy_threshold=self.fuzzy_threshold, logger=self.logger
+        )
+
+    @property
+    def is_stale(self):
+        return time.time() - self.fetched_at > self.ttl_seconds
+
+    def _fetch(self):
+        """同步的条件请求，在线程池中执行"""
+        import requests
+
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        response = requests.get(self.url, headers=headers, timeout=self.request_timeout)
+        if response.status_code == 304:
+            return None, response.headers
+        response.raise_for_status()
+        response.encoding = response.encoding or 'utf-8'
+        return response.text, response.headers
+
+    async def _refresh(self):
+        try:
+            content, headers = await asyncio.get_event_loop().run_in_executor(None, self._fetch)
+            if content is None:
+                self.logger.info("Avatar.js 未变化，延长角色索引有效期")
+            else:
+                characters = await asyncio.get_event_loop().run_in_executor(
+                    None, parse_avatar_js, content
+                )
+                self._rebuild(characters)
+                self.logger.info(f"角色索引已更新，共 {len(self.characters)} 个角色")
+            self.etag = headers.get('ETag', self.etag)
+            self.last_modified = headers.get('Last-Modified', self.last_modified)
+            self.fetched_at = time.time()
+            self._save()
+            return True
+        except Exception as e:
+            self.logger.error(f"刷新角色索引时出错: {e}")
+            return False
+
+    async def refresh(self):
+        """刷新索引；并发调用共享同一次请求"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._refresh())
+        return await asyncio.shield(self._refresh_task)
+
+    async def ensure_loaded(self):
+        """没有任何索引时等待拉取；索引过期时在后台重新验证，不阻塞调用方"""
+        if not self.characters:
+            await self.refresh()
+        elif self.is_stale and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = asyncio.ensure_future(self._refresh())
+
+    async def resolve(self, character_name):
+        """把用户输入解析为角色，支持别名、拼音与错别字，失败时附带候选名称"""
+        await self.ensure_loaded()
+        return self.name_index.resolve(character_name)
+
+    async def get_id(self, character_name):
+        """根据角色名获取角色ID，找不到时返回 None"""
+        return (await self.resolve(character_name)).char_id
+
+    def entry_hash(self, character_id):
+        """Avatar.js 中该角色条目的内容哈希，用于判断快照是否需要重新渲染"""
+        return self.entry_hashes.get(str(character_id))
+
+    def get_character(self, character_id):
+        """根据角色ID获取 Avatar.js 中的原始条目"""
+        return self.by_id.get(str(character_id))
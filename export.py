@@ -0,0 +1,249 @@
+"""批量导出：并发渲染一批角色并写入快照存储，供版本更新后整体刷新
+
+在 QChatGPT 根目录下运行（需要能导入 pkg 与插件包）：
+
+    python -m plugins.<插件目录>.export --all --concurrency 4
+    python -m plugins.<插件目录>.export 希儿 1225 --file extra.txt
+    python -m plugins.<插件目录>.export --resume
+
+中断后加 --resume 继续：本批开始后已生成（或确认内容未变化）的快照不会重复渲染。
+"""
+import os
+import sys
+import json
+import time
+import math
+import asyncio
+import logging
+import argparse
+
+from .fetch_characters import CharacterDataManager
+from .character_index import CharacterIndex
+from .image_pipeline import ImageEncoding
+from .metrics import Metrics
+
+
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_FILENAME = 'export_state.json'
+
+
+class ExportState:
+    """批量任务的断点信息：开始时间与目标列表，全部成功后删除"""
+
+    def __init__(self, path, started_at=None, targets=None):
+        self.path = path
+        self.started_at = started_at or time.time()
+        self.targets = targets or []
+
+    @classmethod
+    def load(cls, path):
+        """读取上次未完成的批量任务，不存在时返回 None"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        return cls(path, data['started_at'], [tuple(target) for target in data['targets']])
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'started_at': self.started_at, 'targets': self.targets}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def read_target_file(path):
+    """每行一个角色名或角色ID，忽略空行与 # 开头的注释"""
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = (line.strip() for line in f)
+        return [line for line in lines if line and not line.startswith('#')]
+
+
+async def resolve_targets(index, queries, include_all=False):
+    """把输入解析为去重后的 [(角色ID, 角色名)]，返回 (目标列表, 无法解析的输入及候选)"""
+    await index.ensure_loaded()
+    targets = {}
+    unresolved = []
+    if include_all:
+        for character in index.characters:
+            char_id = str(character.get('_id', ''))
+            if char_id and character.get('Name'):
+                targets.setdefault(char_id, character['Name'])
+    for query in queries:
+        character = index.get_character(query)
+        if character is not None:
+            targets.setdefault(str(query), character.get('Name') or str(query))
+            continue
+        resolution = index.name_index.resolve(query)
+        if resolution:
+            targets.setdefault(resolution.char_id, resolution.name)
+        else:
+            unresolved.append((query, resolution.suggestions))
+    return list(targets.items()), unresolved
+
+
+def _latency(histogram_snapshot):
+    return {key: value for key, value in histogram_snapshot.items() if key != 'buckets'}
+
+
+async def export_one(manager, char_id, name, semaphore, jobs, progress):
+    """渲染单个角色，返回 rendered / unchanged / failed"""
+    async with semaphore:
+        start = time.time()
+        ok = await manager.prerender(char_id, name)
+        elapsed = time.time() - start
+    if not ok:
+        outcome = 'failed'
+    else:
+        # 内容未变化时只延长有效期，渲染时间仍是上一次的
+        rendered_at = manager.snapshot_store.rendered_at(char_id)
+        outcome = 'rendered' if rendered_at is not None and rendered_at >= start else 'unchanged'
+    jobs.observe(outcome, elapsed)
+    progress['done'] += 1
+    print(f"[{progress['done']}/{progress['total']}] {char_id} {name}: {outcome} {elapsed:.2f}s")
+    return outcome
+
+
+async def run(args):
+    state_path = os.path.join(args.data_dir, STATE_FILENAME)
+    index = CharacterIndex(
+        cache_path=os.path.join(PLUGIN_DIR, 'avatar_index.json'),
+        aliases_path=os.path.join(PLUGIN_DIR, 'aliases.json')
+    )
+
+    queries = list(args.targets)
+    if args.file:
+        queries.extend(read_target_file(args.file))
+    targets, unresolved = [], []
+    if queries or args.all:
+        targets, unresolved = await resolve_targets(index, queries, args.all)
+
+    state = None
+    if args.resume:
+        state = ExportState.load(state_path)
+        if state is None:
+            raise SystemExit("没有可恢复的批量任务")
+        # 恢复时沿用上次的目标列表，命令行中另外指定的角色一并加入
+        known = {char_id for char_id, _ in state.targets}
+        state.targets.extend(target for target in targets if target[0] not in known)
+        targets = state.targets
+    elif not targets:
+        raise SystemExit("没有需要渲染的角色，请指定角色名/ID、--file 或 --all")
+    else:
+        state = ExportState(state_path, targets=targets)
+    state.save()
+
+    manager = CharacterDataManager(
+        pool_size=args.browsers,
+        # 并发渲染共用浏览器，每个浏览器同时承载多个上下文
+        contexts_per_browser=math.ceil(args.concurrency / args.browsers),
+        capture_mode=args.capture_mode,
+        image_encoding=ImageEncoding(format=args.format, quality=args.quality,
+                                     target_bytes=10 * 1024 * 1024),
+        image_workers=min(args.concurrency, os.cpu_count() or 1),
+        delivery_mode=args.delivery,
+        freshness_probe=None if args.force else 'page',
+        data_dir=args.data_dir,
+        # 插件可能同时在运行，资源与区块缓存使用单独的子目录，快照仍写入共用的快照存储
+        cache_namespace='export'
+    )
+    manager.char_index = index
+
+    # 本批开始后已生成或确认过的快照视为完成
+    pending = []
+    for char_id, name in targets:
+        fresh_since = manager.snapshot_rendered_at(char_id)
+        if args.resume and fresh_since is not None and fresh_since >= state.started_at:
+            continue
+        pending.append((char_id, name))
+
+    jobs = Metrics()
+    progress = {'done': 0, 'total': len(pending)}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    wall_start = time.time()
+    try:
+        await manager.start()
+        outcomes = await asyncio.gather(*(
+            export_one(manager, char_id, name, semaphore, jobs, progress) for char_id, name in pending
+        ))
+    finally:
+        await manager.close()
+    wall = time.time() - wall_start
+
+    failed = [char_id for (char_id, _), outcome in zip(pending, outcomes) if outcome == 'failed']
+    if not failed:
+        state.clear()
+    stages = manager.metrics.snapshot()['stages']
+    return {
+        "targets": len(targets),
+        "skipped": len(targets) - len(pending),
+        "rendered": outcomes.count('rendered'),
+        "unchanged": outcomes.count('unchanged'),
+        "failed": failed,
+        "unresolved": [{"query": query, "suggestions": suggestions} for query, suggestions in unresolved],
+        "concurrency": args.concurrency,
+        "wall_s": round(wall, 2),
+        "per_minute": round(len(pending) / wall * 60, 1) if wall else 0.0,
+        "latency": {outcome: _latency(h.snapshot()) for outcome, h in jobs.histograms.items()},
+        "stages": {stage: _latency(snapshot) for stage, snapshot in stages.items()},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="StarRailCharacterFetcher 批量生成角色快照")
+    parser.add_argument('targets', nargs='*', help="角色名、别名或角色ID")
+    parser.add_argument('--all', action='store_true', help="渲染 Avatar.js 中的全部角色")
+    parser.add_argument('--file', help="从文件读取角色，每行一个")
+    parser.add_argument('--resume', action='store_true', help="继续上次中断或有失败的批量任务")
+    parser.add_argument('--concurrency', type=int, default=4, help="同时渲染的角色数")
+    parser.add_argument('--browsers', type=int, default=1, help="浏览器实例数，并发渲染平均分配到各实例")
+    parser.add_argument('--force', action='store_true', help="不做内容探测，全部重新截图")
+    parser.add_argument('--capture-mode', default='sections', choices=('resize', 'full_page', 'sections'))
+    parser.add_argument('--delivery', default='slices', choices=('single', 'slices'), help="快照保存方式，需与插件配置一致")
+    parser.add_argument('--format', default='JPEG', choices=('JPEG', 'WEBP'), help="图片格式，需与插件配置一致")
+    parser.add_argument('--quality', type=int, default=90)
+    parser.add_argument('--data-dir', default=PLUGIN_DIR, help="快照存放目录，默认为插件目录")
+    parser.add_argument('--json', action='store_true', help="以 JSON 输出汇总")
+    parser.add_argument('--verbose', action='store_true', help="输出渲染日志")
+    args = parser.parse_args(argv)
+    args.concurrency = max(1, args.concurrency)
+    args.browsers = max(1, min(args.browsers, args.concurrency))
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    try:
+        report = asyncio.run(run(args))
+    except KeyboardInterrupt:
+        print("\n已中断，已生成的快照保留在快照存储中，加 --resume 继续")
+        sys.exit(130)
+
+    if args.json:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print(f"\n共 {report['targets']} 个角色：渲染 {report['rendered']}，内容未变化 {report['unchanged']}，"
+              f"跳过 {report['skipped']}，失败 {len(report['failed'])}")
+        print(f"并发 {report['concurrency']}，耗时 {report['wall_s']}s，{report['per_minute']} 个/分钟")
+        for outcome, stats in report['latency'].items():
+            print(f"  {outcome:<16} n={stats['count']:<4} p50={stats['p50_ms']:>9}ms  "
+                  f"p95={stats['p95_ms']:>9}ms  max={stats['max_ms']:>9}ms")
+        if report['stages']:
+            print("\n[stages]")
+            for stage, stats in report['stages'].items():
+                print(f"  {stage:<16} n={stats['count']:<4} p50={stats['p50_ms']:>9}ms  p95={stats['p95_ms']:>9}ms")
+        if report['failed']:
+            print(f"\n失败的角色: {', '.join(report['failed'])}，加 --resume 重试")
+        for item in report['unresolved']:
+            hint = f"，你是不是想找：{'、'.join(item['suggestions'])}" if item['suggestions'] else ""
+            print(f"无法识别 {item['query']}{hint}")
+    if report['failed'] or report['unresolved']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,320 +1,657 @@
 import os
-from datetime import datetime, timedelta
-import math
-from playwright.async_api import async_playwright
-import traceback
-from PIL import Image
+import json
+import asyncio
+import logging
 import time  # 添加在文件开头的导入部分
-from io import BytesIO
 import base64
+from collections import Counter, deque
 from pkg.plugin.context import mirai
+from .browser_pool import BrowserPool
+from .render_worker import RenderWorkerPool
+from .renderer import PageRenderer, RenderTimeouts
+from .snapshot_cache import SnapshotCache
+from .snapshot_store import SnapshotStore
+from .asset_cache import AssetCache
+from .section_cache import SectionCache
+from .card_renderer import CharacterCardRenderer
+from .image_pipeline import ImagePipeline, ImageEncoding
+from .metrics import Metrics
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('utf-8')
+
 
 class CharacterDataManager:
-    def __init__(self):
+    def __init__(self, pool_size=1, max_renders_per_browser=50, max_browser_rss_mb=1536,
+                 contexts_per_browser=1, render_timeouts=None, capture_mode='resize', max_age_hours=24,
+                 memory_cache_mb=64, image_encoding=None, image_workers=2,
+                 snapshot_disk_mb=512, snapshot_max_age_days=7, asset_cache_mb=256,
+                 asset_allowed_hosts=('homdgcat.wiki',), section_cache_mb=256, delivery_mode='single',
+                 slice_aspect=2.0, slice_overlap=50, freshness_probe='page', render_engine='browser',
+                 card_fallback=True, card_font_path=None, render_workers=0, worker_max_jobs=200,
+                 worker_max_rss_mb=1536, base_url="https://homdgcat.wiki/sr/char", data_dir=None,
+                 cache_namespace=None, logger=None):
         self.data = None
+        self.logger = logger or logging.getLogger(__name__)
+        # 分阶段延迟直方图与计数器
+        self.metrics = Metrics()
+        self.max_age_hours = max_age_hours
+        # 发送方式：single 为整张长图，slices 为按手机屏幕比例切分的多张图片
+        if delivery_mode not in ('single', 'slices'):
+            raise ValueError(f"不支持的发送方式: {delivery_mode}")
+        self.delivery_mode = delivery_mode
+        self.slice_aspect = slice_aspect
+        self.slice_overlap = slice_overlap
+        # 快照过期后的内容探测：page 加载页面比对内容哈希，未变化时不截图也不编码；
+        # source 先比对 Avatar.js 中的角色条目，无需打开浏览器，不一致时再退回 page；None 为总是重新渲染
+        if freshness_probe not in ('page', 'source', None):
+            raise ValueError(f"不支持的内容探测方式: {freshness_probe}")
+        self.freshness_probe = freshness_probe
+        # 角色索引（CharacterIndex），提供 Avatar.js 条目及其哈希，由插件设置
+        self.char_index = None
+        # 渲染准入控制（RenderScheduler），排队与拒绝计数计入指标快照，由插件设置
+        self.render_scheduler = None
+        # 渲染引擎：browser 为浏览器截图，card 为直接由 Avatar.js 数据绘制卡片；
+        # card_fallback 为 True 时浏览器渲染失败改用卡片
+        if render_engine not in ('browser', 'card'):
+            raise ValueError(f"不支持的渲染引擎: {render_engine}")
+        self.render_engine = render_engine
+        self.card_fallback = card_fallback
+        self.card_renderer = CharacterCardRenderer(font_path=card_font_path, logger=self.logger)
+        self.base_url = base_url
         self.plugin_dir = os.path.dirname(os.path.abspath(__file__))
-        self.snapshot_dir = os.path.join(self.plugin_dir, 'snapshots')
-        os.makedirs(self.snapshot_dir, exist_ok=True)
+        # 快照与资源缓存的存放目录，默认位于插件目录下
+        self.data_dir = data_dir or self.plugin_dir
+        self.snapshot_dir = os.path.join(self.data_dir, 'snapshots')
+        # 资源与区块缓存的索引只由一个进程维护；与插件共用数据目录的其他进程（如批量导出）
+        # 通过 cache_namespace 使用各自的子目录，快照存储本身可以安全共用
+        self.cache_dirs = {}
+        for name in ('asset_cache', 'section_cache'):
+            cache_dir = os.path.join(self.data_dir, name)
+            self.cache_dirs[name] = os.path.join(cache_dir, cache_namespace) if cache_namespace else cache_dir
+        # 常驻浏览器池，由插件在初始化时启动、在卸载时关闭
+        self.browser_pool = BrowserPool(
+            size=pool_size,
+            max_renders_per_browser=max_renders_per_browser,
+            max_rss_mb=max_browser_rss_mb,
+            contexts_per_browser=contexts_per_browser,
+            logger=self.logger
+        )
+        # 单次加载的页面渲染器，各阶段超时可通过 RenderTimeouts 配置
+        render_timeouts = render_timeouts or RenderTimeouts()
+        self.renderer = PageRenderer(
+            viewport_width=600,
+            timeouts=render_timeouts,
+            capture_mode=capture_mode,
+            logger=self.logger
+        )
+        # 截图后处理流水线，输出格式与目标大小由 ImageEncoding 配置
+        self.image_pipeline = ImagePipeline(
+            encoding=image_encoding or ImageEncoding(),
+            max_workers=image_workers
+        )
+        # 渲染时的本地静态资源缓存，同时拦截第三方与统计请求
+        self.asset_cache = AssetCache(
+            self.cache_dirs['asset_cache'],
+            allowed_hosts=asset_allowed_hosts,
+            max_total_mb=asset_cache_mb,
+            logger=self.logger
+        )
+        # render_workers 大于 0 时浏览器运行在独立的子进程中，崩溃或卡死不会拖垮宿主；
+        # 此时本进程的浏览器池不会启动
+        self.worker_pool = None
+        if render_workers:
+            self.worker_pool = RenderWorkerPool(
+                size=render_workers,
+                max_jobs=worker_max_jobs,
+                max_rss_mb=worker_max_rss_mb,
+                # 子进程自身也按 overall 超时，这里多留出启动浏览器与传输截图的余量
+                job_timeout=render_timeouts.overall + 30,
+                worker_options={
+                    'viewport_width': self.renderer.viewport_width,
+                    'timeouts': dict(render_timeouts.__dict__),
+                    'capture_mode': capture_mode,
+                    'max_renders_per_browser': max_renders_per_browser,
+                    # 各子进程在 cache_dir 下使用自己的子目录，总上限平均分给各个子进程
+                    'asset_cache': {
+                        'cache_dir': self.asset_cache.cache_dir,
+                        'allowed_hosts': list(asset_allowed_hosts),
+                        'max_total_mb': asset_cache_mb / render_workers if asset_cache_mb else asset_cache_mb,
+                    },
+                },
+                logger=self.logger
+            )
+        # sections 截图模式下按内容哈希缓存的区块截图，刷新时只重新截取变化的区块
+        self.section_cache = None
+        if capture_mode == 'sections':
+            self.section_cache = SectionCache(
+                self.cache_dirs['section_cache'],
+                max_total_mb=section_cache_mb,
+                logger=self.logger
+            )
+        # 正在进行中的渲染任务，按角色ID去重
+        self._inflight = {}
+        # 分片模式下各进行中渲染的第一片，等待者可以提前发出
+        self._first_slices = {}
+        # 正在等待渲染结果的用户请求数，后台预渲染会为其让路
+        self.user_renders = 0
+        # 各角色的请求次数，供后台预热挑选热门角色；持久化在数据目录，重启后保留
+        self.request_counts_path = os.path.join(self.data_dir, 'request_counts.json')
+        self.request_counts = self._load_request_counts()
+        self._saved_request_total = sum(self.request_counts.values())
+        # 最近若干次渲染的分阶段耗时（秒）
+        self.recent_renders = deque(maxlen=100)
+        # 以角色ID为键的磁盘快照存储，后台按时间与总大小淘汰
+        self.snapshot_store = SnapshotStore(
+            self.snapshot_dir,
+            extension=self.image_pipeline.encoding.extension,
+            max_total_mb=snapshot_disk_mb,
+            max_age_days=snapshot_max_age_days,
+            logger=self.logger
+        )
+        # 可直接发送的 base64 载荷的内存缓存，磁盘快照只作为持久化层
+        self.memory_cache = SnapshotCache(
+            max_bytes=memory_cache_mb * 1024 * 1024,
+            ttl_seconds=max_age_hours * 3600
+        )
 
-    def check_snapshot_exists(self, character_name, max_age_hours=24):
-        """检查角色快照是否存在且未过期，并返回base64编码的图片"""
-        snapshot_path = os.path.join(self.snapshot_dir, f'{character_name}.jpg')
-        
-        if not os.path.exists(snapshot_path):
+    def set_logger(self, logger):
+        """改用宿主的日志器，同步到各个子组件"""
+        self.logger = logger
+        for component in (self.browser_pool, self.renderer, self.asset_cache, self.snapshot_store,
+                          self.section_cache, self.card_renderer, self.worker_pool):
+            if component is not None:
+                component.logger = logger
+
+    @property
+    def render_pool(self):
+        """实际执行渲染的池：渲染子进程池，或本进程内的浏览器池"""
+        return self.worker_pool or self.browser_pool
+
+    async def start(self):
+        """启动浏览器池（或渲染子进程）与快照淘汰任务"""
+        await self.render_pool.start()
+        self.snapshot_store.start_eviction()
+
+    async def close(self):
+        """关闭浏览器池，释放所有浏览器进程"""
+        await self.save_request_counts()
+        await self.snapshot_store.stop_eviction()
+        await self.browser_pool.close()
+        if self.worker_pool is not None:
+            await self.worker_pool.close()
+        self.image_pipeline.close()
+
+    def _load_request_counts(self):
+        try:
+            with open(self.request_counts_path, 'r', encoding='utf-8') as f:
+                return Counter(json.load(f))
+        except FileNotFoundError:
+            return Counter()
+        except Exception as e:
+            self.logger.warning(f"读取请求计数失败: {e}")
+            return Counter()
+
+    async def save_request_counts(self):
+        """把请求计数写入数据目录；自上次保存以来没有新请求时不写入，避免覆盖其他进程的计数"""
+        # 计数由事件循环更新，在循环内复制后再交给线程池写入
+        counts = dict(self.request_counts)
+        total = sum(counts.values())
+        if total == self._saved_request_total:
+            return
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, self._write_request_counts, counts)
+            self._saved_request_total = total
+        except OSError as e:
+            self.logger.warning(f"保存请求计数失败: {e}")
+
+    def _write_request_counts(self, counts):
+        tmp_path = f"{self.request_counts_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(counts, f)
+        os.replace(tmp_path, self.request_counts_path)
+
+    def check_snapshot_exists(self, character_id, max_age_hours=None):
+        """检查角色快照是否存在且未过期，返回 (base64载荷, 生效时间戳)，不存在时返回 None
+
+        分片模式下载荷为各分片 base64 字符串的元组。快照已过期但 Avatar.js 条目未变化时直接延长有效期。
+        """
+        if max_age_hours is None:
+            max_age_hours = self.max_age_hours
+        snapshot = self._read_snapshot(character_id, max_age_seconds=max_age_hours * 3600)
+        if snapshot is None and self._source_unchanged(character_id):
+            snapshot = self._extend_snapshot(character_id, 'source')
+        return snapshot
+
+    def _read_snapshot(self, character_id, max_age_seconds=None):
+        """按当前发送方式读取磁盘快照，返回 (base64载荷, 生效时间戳)"""
+        if self.delivery_mode == 'slices':
+            stored = self.snapshot_store.get_slices(character_id, max_age_seconds=max_age_seconds)
+            if stored is None:
+                return None
+            slices, entry = stored
+            return tuple(_b64(data) for data in slices), self.snapshot_store.fresh_since(entry)
+        stored = self.snapshot_store.get(character_id, max_age_seconds=max_age_seconds)
+        if stored is None:
             return None
-            
-        # 检查文件是否过期
-        file_time = datetime.fromtimestamp(os.path.getmtime(snapshot_path))
-        if datetime.now() - file_time > timedelta(hours=max_age_hours):
+        data, entry = stored
+        return _b64(data), self.snapshot_store.fresh_since(entry)
+
+    def _stored_hash_matches(self, character_id, field, value):
+        """快照条目记录的哈希与当前一致，且与当前发送方式相符"""
+        entry = self.snapshot_store.entry(character_id)
+        if entry is None or value is None or entry.get(field) != value:
+            return False
+        return bool(entry.get('slices')) == (self.delivery_mode == 'slices')
+
+    def _stored_content_hash(self, character_id):
+        """与当前发送方式相符的快照所记录的页面内容哈希"""
+        entry = self.snapshot_store.entry(character_id)
+        if entry is None or bool(entry.get('slices')) != (self.delivery_mode == 'slices'):
             return None
-            
-        # 读取文件并转换为base64
+        return entry.get('content_hash')
+
+    def _source_hash(self, character_id):
+        return self.char_index.entry_hash(character_id) if self.char_index is not None else None
+
+    def _source_unchanged(self, character_id):
+        if self.freshness_probe != 'source':
+            return False
+        return self._stored_hash_matches(character_id, 'source_hash', self._source_hash(character_id))
+
+    def _extend_snapshot(self, character_id, probe):
+        """内容未变化：延长快照有效期并返回 (base64载荷, 生效时间戳)，快照文件已不在时返回 None"""
+        if self.snapshot_store.touch(character_id) is None:
+            return None
+        snapshot = self._read_snapshot(character_id)
+        if snapshot is not None:
+            self.metrics.incr('renders_avoided')
+            self.metrics.incr(f'unchanged_{probe}')
+            self.logger.info(f"角色 {character_id} 的内容未变化（{probe}），延长快照有效期")
+        return snapshot
+
+    @staticmethod
+    def _to_images(payload):
+        """单张快照返回一个 mirai.Image，分片快照返回 mirai.Image 列表"""
+        if isinstance(payload, tuple):
+            return [mirai.Image(base64=part) for part in payload]
+        return mirai.Image(base64=payload)
+
+    async def get_character_snapshot(self, character_id="1225", character_name=None):
+        """获取角色页面快照，返回 mirai.Image（分片模式下为列表）"""
+        cached = await self.get_cached_snapshot(character_id)
+        if cached:
+            return cached
+        return await self.render_snapshot(character_id, character_name)
+
+    async def get_cached_snapshot(self, character_id, count_request=True):
+        """只查缓存：先查内存，再查磁盘上未过期的快照，未命中返回 None"""
+        key = str(character_id)
+        if count_request:
+            self.request_counts[key] += 1
+            self.metrics.incr('requests')
+
+        # 其他进程（例如批量导出）改写过的快照，内存中的旧载荷不再使用
+        for changed in self.snapshot_store.take_changed():
+            self.memory_cache.invalidate(changed)
+        payload = self.memory_cache.get(key)
+        if payload:
+            self.metrics.incr('memory_hits')
+            return self._to_images(payload)
+        lookup_start = time.time()
+        existing_snapshot = await asyncio.get_event_loop().run_in_executor(
+            None, self.check_snapshot_exists, key
+        )
+        self.metrics.observe('disk_lookup', time.time() - lookup_start)
+        if existing_snapshot:
+            self.metrics.incr('disk_hits')
+            self.logger.info("找到有效的快照")
+            payload, fresh_since = existing_snapshot
+            self.memory_cache.put(key, payload, stored_at=fresh_since)
+            return self._to_images(payload)
+        return None
+
+    def is_rendering(self, character_id):
+        """该角色是否已有进行中的渲染"""
+        return str(character_id) in self._inflight
+
+    async def render_snapshot(self, character_id, character_name=None, on_first_slice=None):
+        """为用户请求渲染快照（与同角色的进行中渲染合并），失败时返回 None
+
+        分片模式下，第一片编码完成而其余分片仍在编码时会先以 on_first_slice(image) 发出；
+        返回值始终包含全部分片，由调用方跳过已经发出的部分。
+        """
+        self.user_renders += 1
+        try:
+            task = self._shared_render(character_id, character_name)
+            first = self._first_slices.get(str(character_id))
+            if on_first_slice is not None and first is not None:
+                await self._deliver_first_slice(task, first, on_first_slice)
+            # shield 保证单个等待者被取消时不会取消共享的渲染任务
+            payload = await asyncio.shield(task)
+            return self._to_images(payload)
+        except Exception as e:
+            self.logger.error(f"获取快照时出错: {e}")
+            if not self.card_fallback:
+                return None
+            card = await self.get_character_card(character_id)
+            if card is not None:
+                self.metrics.incr('card_fallbacks')
+            return card
+        finally:
+            self.user_renders -= 1
+
+    async def get_character_card(self, character_id):
+        """不经过浏览器，直接由 Avatar.js 数据绘制角色卡片，返回 mirai.Image，无法绘制时返回 None
+
+        卡片只需几十毫秒，缓存在内存中，不写入磁盘快照。
+        """
+        character = self.char_index.get_character(character_id) if self.char_index is not None else None
+        if character is None:
+            self.logger.warning(f"角色索引中没有角色 {character_id}，无法绘制卡片")
+            return None
+        # 以条目哈希为键，Avatar.js 更新后自动重新绘制
+        key = f"card:{character_id}:{self._source_hash(character_id)}"
+        payload = self.memory_cache.get(key)
+        if payload:
+            return mirai.Image(base64=payload)
+        start = time.time()
         try:
-            with open(snapshot_path, 'rb') as f:
-                image_base64 = base64.b64encode(f.read()).decode('utf-8')
-                return mirai.Image(base64=image_base64)
+            image = await asyncio.get_event_loop().run_in_executor(
+                self.image_pipeline.executor, self.card_renderer.render, character
+            )
+            image_bytes = await self.image_pipeline.encode_screenshot(image)
         except Exception as e:
-            print(f"读取图片文件失败: {e}")
+            self.logger.error(f"绘制角色卡片时出错: {e}")
             return None
+        self.metrics.observe('card', time.time() - start)
+        self.metrics.incr('card_renders')
+        payload = _b64(image_bytes)
+        self.memory_cache.put(key, payload)
+        return mirai.Image(base64=payload)
 
-    async def get_character_snapshot(self, character_id="1225", character_name=None):
-        """获取角色页面快照，返回base64编码的图片"""
-        # 先检查是否有未过期的快照
-        if character_name:
-            existing_snapshot = self.check_snapshot_exists(character_name)
-            if existing_snapshot:
-                print(f"找到有效的快照")
-                return existing_snapshot
-        
+    async def _deliver_first_slice(self, task, first, on_first_slice):
+        # asyncio.wait 不会取消传入的任务，等待者被取消时共享渲染照常进行
+        await asyncio.wait({task, first}, return_when=asyncio.FIRST_COMPLETED)
+        if task.done() or first.cancelled():
+            return
+        try:
+            await on_first_slice(mirai.Image(base64=first.result()))
+        except Exception as e:
+            self.logger.warning(f"提前发送第一张分片失败: {e}")
+
+    async def prerender(self, character_id, character_name):
+        """后台预渲染：忽略缓存强制重新生成快照，成功返回 True"""
+        try:
+            await asyncio.shield(self._shared_render(character_id, character_name))
+            return True
+        except Exception as e:
+            self.logger.error(f"预渲染角色 {character_id} 时出错: {e}")
+            return False
+
+    def snapshot_rendered_at(self, character_id):
+        """返回磁盘快照的生效时间戳（重新渲染或确认内容未变化的时间），不存在时返回 None"""
+        entry = self.snapshot_store.entry(character_id)
+        return self.snapshot_store.fresh_since(entry) if entry else None
+
+    def _shared_render(self, character_id, character_name):
+        """同一角色的并发请求共享一次渲染，返回共享的任务"""
+        key = str(character_id)
+        task = self._inflight.get(key)
+        if task is None:
+            if self.delivery_mode == 'slices':
+                self._first_slices[key] = asyncio.get_event_loop().create_future()
+            task = asyncio.ensure_future(self._render_snapshot(character_id, character_name))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_render_done(key, t))
+        else:
+            self.metrics.incr('coalesced')
+            self.logger.info(f"角色 {character_id} 正在渲染中，等待共享结果")
+        return task
+
+    def _on_render_done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            first = self._first_slices.pop(key, None)
+            if first is not None and not first.done():
+                first.cancel()
+        # 所有等待者都已取消时，避免出现 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    async def _render_snapshot(self, character_id, character_name):
+        """实际执行渲染并保存快照，返回 base64 载荷，失败时抛出异常"""
         start_time = time.time()  # 添加总计时器
         
-        url = "https://homdgcat.wiki/sr/char"
+        url = self.base_url
         params = {
             "lang": "CH"
         }
         
         full_url = f"{url}?{'&'.join(f'{k}={v}' for k,v in params.items())}#_{character_id}"
 
+        timings = {}
         try:
-            async with async_playwright() as p:
-                browser_start = time.time()
-                browser = await p.firefox.launch(  # 改用 firefox
-                    headless=True,
-                    args=[
-                        '--no-sandbox',
-                        '--disable-gpu',
-                        '--disable-dev-shm-usage'
-                    ]
-                )
-                page = await browser.new_page()
-                print(f"浏览器启动耗时: {time.time() - browser_start:.2f}秒")
-                
-                # 使用手机竖屏视口大小
-                viewport_width = 600
-                viewport_height = int(viewport_width * 16 / 9)
-                await page.set_viewport_size({"width": viewport_width, "height": viewport_height})
-                
-                page_load_start = time.time()  # 页面加载计时
-                print(f"正在加载页面: {full_url}")
-                try:
-                    # 先导航到页面，使用 domcontentloaded 而不是 networkidle
-                    await page.goto(
-                        full_url, 
-                        wait_until='domcontentloaded',  # 改为更快的加载策略
-                        timeout=60000  # 增加超时时间到60秒
-                    )
-                    
-                    # 等待关键元素出现
-                    print("等待页面内容加载...")
-                    try:
-                        await page.wait_for_selector('div.mon_body', 
-                            state='visible', 
-                            timeout=30000
-                        )
-                    except Exception as e:
-                        print(f"等待内容超时，尝试继续执行: {e}")
-                    
-                    # 给页面一些额外的加载时间
-                    await page.wait_for_timeout(5000)
-                    
-                    print(f"页面初始加载耗时: {time.time() - page_load_start:.2f}秒")
-                except Exception as e:
-                    print(f"页面加载超时: {e}")
-                    
-                # 只禁用一些不必要的资源
-                await page.route("**/*.{woff,woff2,analytics.js}", lambda route: route.abort())
-                
-                # 添加性能优化的页面设置
-                await page.set_extra_http_headers({"Accept-Language": "zh-CN,zh;q=0.9"})
-                
-                # 使用更精确的等待条件
-                await page.wait_for_selector('div.mon_body', state='visible', timeout=15000)
-                
-                # 减少强制渲染等待时间，但确保内容加载完整
-                await page.wait_for_timeout(3000)
-                
-                # 获取总高度和所有section
-                sections_info = await page.evaluate('''() => {
-                    const body = document.querySelector('div.mon_body');
-                    const sections = Array.from(document.querySelectorAll('div.mon_body div.a_section'));
-                    return {
-                        height: body.scrollHeight,
-                        sectionsCount: sections.length
-                    };
-                }''')
-                
-                total_height = sections_info['height']
-                sections_count = sections_info['sectionsCount']
-                print(f"计算得到总高度: {total_height}px, 共 {sections_count} 个区块")
-                
-                # 使用新的足够高的视窗重新加载页面
-                browser = await p.firefox.launch(  # 这里也要改
-                    headless=True,
-                    args=[
-                        '--no-sandbox',
-                        '--disable-gpu',
-                        '--disable-dev-shm-usage'
-                    ]
-                )
-                page = await browser.new_page()
-                
-                # 设置视窗大小
-                await page.set_viewport_size({
-                    "width": viewport_width,
-                    "height": min(total_height + 1000, 15000)  # 限制最大高度为15000px
-                })
-                
-                print("使用完整视窗重新加载页面...")
-                await page.goto(full_url)
-                await page.wait_for_selector('div.mon_body', timeout=30000)
-                
-                # 强制渲染所有section
-                print("强制渲染所有内容...")
-                await page.evaluate('''() => {
-                    const sections = document.querySelectorAll('div.mon_body div.a_section');
-                    sections.forEach((section, index) => {
-                        section.style.transform = 'translateZ(0)';
-                        section.style.willChange = 'transform';
-                        section.style.contain = 'paint';
-                    });
-                    
-                    const observer = new IntersectionObserver((entries) => {
-                        entries.forEach(entry => {
-                            if (!entry.isIntersecting) {
-                                entry.target.style.visibility = 'hidden';
-                                entry.target.style.visibility = 'visible';
-                            }
-                        });
-                    }, {
-                        root: null,
-                        threshold: 0
-                    });
-                    
-                    sections.forEach(section => {
-                        observer.observe(section);
-                    });
-                    
-                    document.body.offsetHeight;
-                    
-                    return new Promise(resolve => setTimeout(resolve, 2000));
-                }''')
-                
-                # 等待渲染完成
-                print("等待渲染完成...")
-                await page.wait_for_timeout(5000)
-                
-                # 隐藏顶部返回按钮
-                await page.evaluate('''() => {
-                    const backSection = document.evaluate(
-                        "/html/body/container/popbodyy/section[2]",
-                        document,
-                        null,
-                        XPathResult.FIRST_ORDERED_NODE_TYPE,
-                        null
-                    ).singleNodeValue;
-                    if (backSection) {
-                        backSection.style.display = "none";
-                    }
-                }''')
-                
-                # 获取内容区域的实际位置和高度
-                content_box = await page.evaluate('''() => {
-                    const content = document.querySelector("div.mon_body");
-                    const rect = content.getBoundingClientRect();
-                    return {
-                        y: rect.top,
-                        height: rect.height
-                    };
-                }''')
-                
-                print(f"内容区域高度: {content_box['height']}px")
-                
-                # 获取完整截图
-                print("开始截取完整页面...")
-                full_screenshot = await page.screenshot(
-                    clip={
-                        "x": 0,
-                        "y": content_box['y'],
-                        "width": viewport_width,
-                        "height": content_box['height']
-                    }
+            # 后台预热绕过了缓存查询，这里同样先做一次无需浏览器的探测
+            if self._source_unchanged(character_id):
+                snapshot = await asyncio.get_event_loop().run_in_executor(
+                    None, self._extend_snapshot, character_id, 'source'
                 )
-                
-                # 计算需要分成几张图片
-                slice_height = int(viewport_width * 16 / 9)  # 手机竖屏比例
-                total_slices = math.ceil(content_box['height'] / (slice_height - 50))  # 留50px重叠区域
-                
-                print(f"需要切割成 {total_slices} 张图片")
-                
-                # 使用 PIL 直接处理内存中的图片数据
-                with Image.open(BytesIO(full_screenshot)) as img:
-                    # 创建一个新的空白图片
-                    final_height = int((total_slices - 1) * (slice_height - 50) + 
-                                     min(slice_height, content_box['height'] - (total_slices - 1) * (slice_height - 50)))
-                    final_image = Image.new('RGB', (int(viewport_width), final_height), 'white')
-                    
-                    # 使用更大的缓冲区来提高处理速度
-                    Image.MAX_IMAGE_PIXELS = None
-                    
-                    for i in range(total_slices):
-                        start_y = int(i * (slice_height - 50))  # 每次减去重叠区域
-                        end_y = int(min(start_y + slice_height, content_box['height']))
-                        
-                        # 裁剪当前切片
-                        slice_img = img.crop((0, start_y, int(viewport_width), end_y))
-                        
-                        # 计算当前切片在最终图片中的位置
-                        paste_y = int(i * (slice_height - 50))
-                        
-                        # 将切片粘贴到最终图片上
-                        final_image.paste(slice_img, (0, paste_y))
-                        print(f"已处理第 {i + 1}/{total_slices} 个切片")
-                    
-                    # 保存最终的完整图片，只使用角色名
-                    final_path = os.path.join(
-                        self.snapshot_dir,
-                        f'{character_name}.jpg'  # 改用 jpg 格式
+                if snapshot is not None:
+                    payload, fresh_since = snapshot
+                    self.memory_cache.put(str(character_id), payload, stored_at=fresh_since)
+                    return payload
+
+            reuse_section = self.section_cache.claim if self.section_cache else None
+            stored_hash = None
+            if self.freshness_probe is not None:
+                stored_hash = self._stored_content_hash(character_id)
+            while True:
+                result, traffic = await self._capture(full_url, reuse_section, stored_hash, timings)
+                if result.get('unchanged'):
+                    snapshot = await asyncio.get_event_loop().run_in_executor(
+                        None, self._extend_snapshot, character_id, 'page'
                     )
-                    # 使用适中的压缩参数，保存为 JPEG
-                    final_image.save(final_path, 
-                                   format='JPEG',  # 明确指定格式
-                                   quality=95,     # 保持较高质量
-                                   optimize=True)  # 启用优化
-                    print(f"已保存完整图片: {final_path}")
-                    
-                    # 读取并转换为base64
-                    with open(final_path, 'rb') as f:
-                        image_base64 = base64.b64encode(f.read()).decode('utf-8')
-                        image_data = mirai.Image(base64=image_base64)
-                
-                await browser.close()
-                total_time = time.time() - start_time
-                print(f"\n总耗时: {total_time:.2f}秒")
-                return image_data
+                    if snapshot is not None:
+                        payload, fresh_since = snapshot
+                        self.memory_cache.put(str(character_id), payload, stored_at=fresh_since)
+                        self.metrics.observe('probe', time.time() - start_time)
+                        return payload
+                    # 快照文件在探测期间被淘汰，重新完整渲染
+                    stored_hash = None
+                    continue
+                if result.get('bands') is None:
+                    break
+                stitch_start = time.time()
+                result['screenshot'] = await self._assemble_sections(result)
+                timings['stitch'] = time.time() - stitch_start
+                if result['screenshot'] is not None:
+                    break
+                # 复用的区块文件已不在磁盘上，这次不再复用，完整截取一遍
+                self.logger.warning(f"角色 {character_id} 的区块缓存缺失，重新截取全部区块")
+                reuse_section = None
+            
+            timings.update(result['timings'])
+            stage_times = ", ".join(f"{k} {v:.2f}秒" for k, v in result['timings'].items())
+            self.logger.info(f"渲染各阶段耗时: {stage_times}")
+            self.logger.info(f"资源流量: 网络 {traffic.network_bytes / 1024:.0f}KB ({traffic.network_requests} 个请求), "
+                  f"缓存 {traffic.cache_bytes / 1024:.0f}KB ({traffic.cache_hits} 个请求), "
+                  f"拦截 {traffic.blocked} 个请求")
+            
+            # 记录内容哈希，下次过期时据此判断是否需要重新截图
+            hashes = {
+                'content_hash': result.get('content_hash'),
+                'source_hash': self._source_hash(character_id),
+            }
+            if self.delivery_mode == 'slices':
+                image_base64 = await self._store_slices(character_id, character_name, result, timings, hashes)
+            else:
+                image_base64 = await self._store_single(character_id, character_name, result, timings, hashes)
+            self.memory_cache.put(str(character_id), image_base64)
             
-        except Exception as e:
             total_time = time.time() - start_time
-            print(f"执行出错，总耗时: {total_time:.2f}秒")
-            print(f"获取快照时出错: {e}")
-            traceback.print_exc()
-            return None
+            timings['total'] = total_time
+            self.recent_renders.append(timings)
+            self.metrics.observe_render(timings)
+            self.metrics.incr('renders')
+            self.logger.info(f"总耗时: {total_time:.2f}秒")
+            return image_base64
+            
+        except Exception:
+            total_time = time.time() - start_time
+            self.metrics.incr('render_failures')
+            self.logger.exception(f"执行出错，总耗时: {total_time:.2f}秒")
+            raise
     
-    def clean_old_snapshots(self, max_age_days=7):
-        """清理旧的快照文件"""
+    async def _capture(self, url, reuse_section, content_hash, timings):
+        """加载页面并截图，返回 (渲染结果, 流量统计)
+
+        配置了渲染子进程时交给子进程执行，否则借用本进程的浏览器池。
+        content_hash 与页面当前内容一致时跳过截图。
+        """
+        capture_start = time.time()
+        if self.worker_pool is not None:
+            result, traffic = await self.worker_pool.render(url, reuse_section, content_hash)
+            # 排队、进程间传输等不属于渲染阶段的耗时
+            timings['worker_overhead'] = max(0.0, time.time() - capture_start - sum(result['timings'].values()))
+            self.asset_cache.totals.merge(traffic)
+            return result, traffic
+
+        unchanged = (lambda digest: digest == content_hash) if content_hash else None
+        async with self.browser_pool.context() as context:
+            timings['browser_acquire'] = time.time() - capture_start
+            self.logger.info(f"获取浏览器上下文耗时: {timings['browser_acquire']:.2f}秒")
+            # 路由必须在导航前安装，首次加载的资源才会走本地缓存
+            traffic = await self.asset_cache.install(context)
+            # 只加载一次页面，等待就绪信号后在同一页面内截图
+            result = await self.renderer.render(context, url, reuse_section, unchanged)
+        return result, traffic
+
+    async def _assemble_sections(self, result):
+        """缓存新截取的区块、读取复用的区块并拼接整页，有区块缺失时返回 None"""
+        bands = result['bands']
+        captured = sum(1 for band in bands if band['png'] is not None)
+
+        def load_and_store():
+            for band in bands:
+                if band['png'] is not None:
+                    self.section_cache.put(band['hash'], band['png'])
+                    continue
+                band['png'] = self.section_cache.get(band['hash'])
+                if band['png'] is None:
+                    return False
+            return True
+
+        if not await asyncio.get_event_loop().run_in_executor(None, load_and_store):
+            return None
+        reused = len(bands) - captured
+        self.section_cache.captured += captured
+        self.section_cache.reused += reused
+        self.metrics.incr('sections_captured', captured)
+        self.metrics.incr('sections_reused', reused)
+        self.logger.info(f"区块截图: 新截取 {captured} 个，复用 {reused} 个")
+        return await self.image_pipeline.stitch(bands, result['width'], result['height'])
+
+    async def _store_single(self, character_id, character_name, result, timings, hashes):
+        """把截图编码为一张图片并保存，返回 base64 载荷"""
+        # 解码与编码在线程池中进行，不阻塞事件循环
+        encode_start = time.time()
+        image_bytes = await self.image_pipeline.encode_screenshot(result['screenshot'])
+        timings['encode'] = time.time() - encode_start
+        self.logger.info(f"图片编码耗时: {timings['encode']:.2f}秒，大小 {len(image_bytes) / 1024:.0f}KB")
+
+        # 磁盘只作为持久化层，载荷直接从内存编码
+        store_start = time.time()
+        await asyncio.get_event_loop().run_in_executor(
+            None,
+            lambda: self.snapshot_store.put(character_id, image_bytes, name=character_name, **hashes)
+        )
+        timings['store'] = time.time() - store_start
+        self.logger.info(f"已保存角色 {character_id} 的快照")
+        return _b64(image_bytes)
+
+    async def _store_slices(self, character_id, character_name, result, timings, hashes):
+        """把截图切片后并行编码并逐片保存，返回各分片 base64 载荷的元组"""
+        encode_start = time.time()
+        futures = await self.image_pipeline.encode_slices(
+            result['screenshot'], self.slice_aspect, self.slice_overlap
+        )
         try:
-            now = datetime.now()
-            for filename in os.listdir(self.snapshot_dir):
-                filepath = os.path.join(self.snapshot_dir, filename)
-                file_time = datetime.fromtimestamp(os.path.getmtime(filepath))
-                if now - file_time > timedelta(days=max_age_days):
-                    os.remove(filepath)
-                    print(f"已删除过期快照: {filename}")
-        except Exception as e:
-            print(f"清理快照时出错: {e}")
+            first = await futures[0]
+            timings['first_slice'] = time.time() - encode_start
+            waiter = self._first_slices.get(str(character_id))
+            if waiter is not None and not waiter.done():
+                waiter.set_result(_b64(first))
+            slices = [first] + list(await asyncio.gather(*futures[1:]))
+        except Exception:
+            # 取回其余分片的结果，避免未处理异常的警告
+            await asyncio.gather(*futures, return_exceptions=True)
+            raise
+        timings['encode'] = time.time() - encode_start
+        self.logger.info(f"分片编码耗时: {timings['encode']:.2f}秒（第一片 {timings['first_slice']:.2f}秒），"
+                         f"共 {len(slices)} 片，大小 {sum(map(len, slices)) / 1024:.0f}KB")
 
-# 修改主函数为异步
-async def main():
-    total_start_time = time.time()
-    manager = CharacterDataManager()
-    
-    # 清理旧快照
-    manager.clean_old_snapshots()
-    
-    # 获取特定角色的快照
-    character_ids = ["1225"]
-    character_names = ["忘归人"]
-    for char_id, character_name in zip(character_ids, character_names):
-        snapshot_paths = await manager.get_character_snapshot(char_id, character_name)
-        if snapshot_paths:
-            print(f"角色 {char_id} 的快照已生成:")
-            for i, path in enumerate(snapshot_paths, 1):
-                print(f"第 {i} 张: {path}")
-        else:
-            print(f"角色 {char_id} 的快照生成失败")
-    
-    total_time = time.time() - total_start_time
-    print(f"\n程序总耗时: {total_time:.2f}秒")
+        store_start = time.time()
+        await asyncio.get_event_loop().run_in_executor(
+            None,
+            lambda: self.snapshot_store.put_slices(character_id, slices, name=character_name, **hashes)
+        )
+        timings['store'] = time.time() - store_start
+        self.logger.info(f"已保存角色 {character_id} 的 {len(slices)} 张分片快照")
+        return tuple(_b64(data) for data in slices)
+
+    def status(self, include_rss=True):
+        """汇总指标快照：分阶段延迟、缓存命中率、在途/排队渲染数、准入控制与浏览器内存
+
+        读取的都是事件循环维护的结构，需要在事件循环中调用；include_rss 为 False 时不扫描进程内存。
+        """
+        snapshot = self.metrics.snapshot()
+        scheduler = self.render_scheduler.stats() if self.render_scheduler is not None else None
+        snapshot.update({
+            "inflight_renders": len(self._inflight),
+            # 配置了准入控制时请求在它的队列中等待，渲染池前几乎不会排队
+            "queued_renders": scheduler['waiting'] if scheduler else self.render_pool.waiting,
+            "render_scheduler": scheduler,
+            "memory_cache": self.memory_cache.stats(),
+            "snapshot_store": self.snapshot_store.stats(),
+            "asset_cache": self._asset_cache_stats(),
+            "section_cache": self.section_cache.stats() if self.section_cache else None,
+            "browser_pool": self.render_pool.stats(include_rss=include_rss),
+        })
+        return snapshot
+
+    def _asset_cache_stats(self):
+        """资源缓存统计；使用渲染子进程时条目数与大小取自各子进程的上报，流量为本进程累计的汇总"""
+        if self.worker_pool is None:
+            return self.asset_cache.stats()
+        return {**self.worker_pool.asset_cache_stats(), **self.asset_cache.totals.as_dict()}
+
+    async def export_metrics(self, path):
+        """把指标快照写成 JSON 文件，返回写入的快照
+
+        快照在事件循环中生成，只有进程内存扫描与文件写入放到线程池中。
+        """
+        snapshot = self.status(include_rss=False)
+        return await asyncio.get_event_loop().run_in_executor(None, self._write_metrics, path, snapshot)
+
+    def _write_metrics(self, path, snapshot):
+        snapshot['browser_pool']['rss_bytes'] = self.render_pool.rss_bytes()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        return snapshot
+
+    def clean_old_snapshots(self):
+        """按清单淘汰超龄或超出总大小限制的快照文件"""
+        try:
+            removed = self.snapshot_store.evict()
+            self.logger.info(f"已删除 {removed} 个过期快照")
+        except Exception as e:
+            self.logger.error(f"清理快照时出错: {e}")
 
 if __name__ == "__main__":
-    import asyncio
-    asyncio.run(main())
+    # 批量生成快照的命令行入口见 export.py
+    from .export import main
+    main()
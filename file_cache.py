@@ -0,0 +1,108 @@
+import os
+import logging
+import json
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def file_lock(path):
+    """跨进程的排他锁，锁文件不存在时自动创建；会阻塞等待，不要在事件循环中调用"""
+    with open(path, 'a+b') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class IndexedFileCache:
+    """以 JSON 索引记录条目的磁盘文件缓存：原子写入，总大小超限时从最久未用的条目开始淘汰
+
+    子类通过 _path 决定文件名，EVICTION_FIELD 为条目中用于排序淘汰的时间字段，
+    _pinned 返回 True 的条目（及其之后更新的条目）不参与淘汰。
+    """
+
+    EVICTION_FIELD = 'stored_at'
+    DESCRIPTION = '缓存'
+
+    def __init__(self, cache_dir, max_total_mb=256, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.cache_dir = cache_dir
+        self.max_total_bytes = max_total_mb * 1024 * 1024 if max_total_mb else None
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index = self._load_index()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            self.logger.warning(f"读取{self.DESCRIPTION}索引失败: {e}")
+            return {}
+
+    def _save_index(self):
+        self._atomic_write(self.index_path, json.dumps(self.index).encode('utf-8'))
+
+    @staticmethod
+    def _atomic_write(path, data):
+        """写入以进程与线程区分的临时文件再 rename，同一条目的并发写入互不干扰"""
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _pinned(self, entry):
+        return False
+
+    def _put(self, key, data, entry):
+        """写入文件并登记索引条目，随后按总大小淘汰"""
+        self._atomic_write(self._path(key), data)
+        with self._lock:
+            self.index[key] = entry
+            self._evict_locked()
+            self._save_index()
+
+    def _evict_locked(self):
+        if not self.max_total_bytes:
+            return
+        total = self.total_bytes
+        for key, entry in sorted(self.index.items(), key=lambda item: item[1][self.EVICTION_FIELD]):
+            if total <= self.max_total_bytes or self._pinned(entry):
+                break
+            del self.index[key]
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            total -= entry['size']
+
+    @property
+    def total_bytes(self):
+        return sum(entry['size'] for entry in self.index.values())
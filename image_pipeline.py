@@ -0,0 +1,164 @@
+import asyncio
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _pil_image():
+    """首次编码时才导入 PIL，避免拖慢插件加载"""
+    from PIL import Image
+    # 整页截图可能高达 15000px，关闭 PIL 的像素数保护
+    Image.MAX_IMAGE_PIXELS = None
+    return Image
+
+
+class ImageEncoding:
+    """输出图片的编码参数；target_bytes 不为空时按目标大小自动降低质量或缩放"""
+
+    FORMATS = {
+        'JPEG': '.jpg',
+        'WEBP': '.webp',
+    }
+
+    def __init__(self, format='JPEG', quality=90, progressive=True, optimize=False,
+                 target_bytes=None, min_quality=40, min_scale=0.5):
+        format = format.upper()
+        if format not in self.FORMATS:
+            raise ValueError(f"不支持的图片格式: {format}")
+        self.format = format
+        self.quality = quality
+        self.progressive = progressive
+        self.optimize = optimize
+        self.target_bytes = target_bytes
+        self.min_quality = min_quality
+        self.min_scale = min_scale
+
+    @property
+    def extension(self):
+        return self.FORMATS[self.format]
+
+    def save_options(self, quality):
+        if self.format == 'WEBP':
+            return {'format': 'WEBP', 'quality': quality, 'method': 4}
+        return {
+            'format': 'JPEG',
+            'quality': quality,
+            'progressive': self.progressive,
+            'optimize': self.optimize,
+        }
+
+
+def _encode(image, encoding, quality):
+    buffer = BytesIO()
+    image.save(buffer, **encoding.save_options(quality))
+    return buffer.getvalue()
+
+
+def encode_image(image, encoding):
+    """按编码参数编码图片；设置了目标大小时先二分质量，仍超出再按比例缩小"""
+    data = _encode(image, encoding, encoding.quality)
+    if not encoding.target_bytes or len(data) <= encoding.target_bytes:
+        return data
+
+    # 在 [min_quality, quality) 中二分查找满足大小限制的最高质量
+    low, high = encoding.min_quality, encoding.quality - 1
+    best = None
+    while low <= high:
+        quality = (low + high) // 2
+        candidate = _encode(image, encoding, quality)
+        if len(candidate) <= encoding.target_bytes:
+            best = candidate
+            low = quality + 1
+        else:
+            high = quality - 1
+    if best is not None:
+        return best
+
+    # 最低质量仍然超出时，按面积比例缩小图片
+    scale = 1.0
+    data = _encode(image, encoding, encoding.min_quality)
+    while len(data) > encoding.target_bytes and scale > encoding.min_scale:
+        scale = max(encoding.min_scale, scale * (encoding.target_bytes / len(data)) ** 0.5 * 0.95)
+        size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+        data = _encode(image.resize(size, _pil_image().LANCZOS), encoding, encoding.min_quality)
+    return data
+
+
+def decode_screenshot(png_bytes):
+    """解码 PNG 截图；截图带透明通道，JPEG 需要转换为 RGB。已拼接好的图片原样返回"""
+    if not isinstance(png_bytes, (bytes, bytearray)):
+        return png_bytes
+    with _pil_image().open(BytesIO(png_bytes)) as img:
+        return img.convert('RGB')
+
+
+def stitch_bands(bands, width, height):
+    """把各横条的 PNG 截图按纵向位置拼回整页图片"""
+    Image = _pil_image()
+    canvas = Image.new('RGB', (width, height), (255, 255, 255))
+    for band in bands:
+        with Image.open(BytesIO(band['png'])) as img:
+            canvas.paste(img.convert('RGB'), (0, band['y']))
+    return canvas
+
+
+def process_screenshot(png_bytes, encoding):
+    """解码截图并重新编码，在工作线程中执行"""
+    # 直接使用整张截图，不再裁剪拼接
+    return encode_image(decode_screenshot(png_bytes), encoding)
+
+
+def slice_bounds(height, slice_height, overlap=50):
+    """按固定高度切分长图，相邻分片重叠 overlap 像素；末尾过短的部分并入上一片"""
+    slice_height = max(slice_height, overlap * 2 + 1)
+    step = slice_height - overlap
+    bounds = []
+    top = 0
+    while top + slice_height < height:
+        bounds.append((top, top + slice_height))
+        top += step
+    if bounds and height - top < slice_height // 4:
+        bounds[-1] = (bounds[-1][0], height)
+    else:
+        bounds.append((top, height))
+    return bounds
+
+
+def encode_region(image, top, bottom, encoding):
+    """裁剪出 [top, bottom) 区域并编码"""
+    return encode_image(image.crop((0, top, image.width, bottom)), encoding)
+
+
+class ImagePipeline:
+    """把截图的解码与编码放到线程池中，避免阻塞事件循环"""
+
+    def __init__(self, encoding=None, max_workers=2):
+        self.encoding = encoding or ImageEncoding()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sr-image')
+
+    async def stitch(self, bands, width, height):
+        """在工作线程中拼接横条，返回的图片可直接交给 encode_screenshot / encode_slices"""
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, stitch_bands, bands, width, height
+        )
+
+    async def encode_screenshot(self, png_bytes):
+        """返回编码后的图片字节"""
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, process_screenshot, png_bytes, self.encoding
+        )
+
+    async def encode_slices(self, png_bytes, slice_aspect=2.0, overlap=50):
+        """把截图切成接近手机屏幕比例的分片并行编码
+
+        返回按顺序排列的 future 列表，调用方可以先等第一片、再等其余分片。
+        """
+        loop = asyncio.get_event_loop()
+        image = await loop.run_in_executor(self.executor, decode_screenshot, png_bytes)
+        bounds = slice_bounds(image.height, int(image.width * slice_aspect), overlap)
+        return [
+            loop.run_in_executor(self.executor, encode_region, image, top, bottom, self.encoding)
+            for top, bottom in bounds
+        ]
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -1,14 +1,18 @@
 # -*- coding: utf-8 -*-
+import os
 import re
-import requests
-import json
+import time
 import asyncio
-import subprocess
 from concurrent.futures import ThreadPoolExecutor
 from pkg.plugin.context import register, handler, BasePlugin, APIHost, EventContext, mirai
 from pkg.plugin.events import PersonNormalMessageReceived, GroupNormalMessageReceived
 from .fetch_characters import CharacterDataManager
-from playwright.async_api import async_playwright
+from .renderer import RenderTimeouts
+from .character_index import CharacterIndex
+from .prewarm import PrewarmScheduler
+from .image_pipeline import ImageEncoding
+from .render_scheduler import RenderScheduler, RenderRejected
+from . import bootstrap
 
 @register(name="StarRailCharacterFetcher", description="爬取崩坏：星穹铁道角色信息",
           version="1.0", author="BiFangKNT")
@@ -17,8 +21,79 @@ class StarRailCharacterPlugin(BasePlugin):
     def __init__(self, host: APIHost):
         super().__init__(host)
         self.base_url = "https://homdgcat.wiki/sr/char?lang=CH"
-        self.message_pattern = re.compile(r'^爬取崩铁：(.{1,5})|崩铁爬虫帮助$')
-        self.char_manager = CharacterDataManager()  # 初始化角色管理器
+        self.message_pattern = re.compile(r'^爬取崩铁(卡片)?：(.{1,20})|崩铁爬虫帮助$|崩铁爬虫状态$')
+        # 初始化角色管理器，浏览器池在 initialize 中启动
+        self.char_manager = CharacterDataManager(
+            pool_size=1,                  # 常驻浏览器实例数（render_workers 为 0 时使用）
+            max_renders_per_browser=50,   # 单个浏览器渲染多少次后回收重启
+            max_browser_rss_mb=1536,      # 浏览器进程总内存超过该值时回收
+            # 各渲染阶段超时（秒），overall 为单次渲染的硬性截止时间
+            render_timeouts=RenderTimeouts(
+                navigation=30, content=30, sections_stable=10, images=10,
+                fonts=5, network_idle=5, screenshot=30, overall=90
+            ),
+            # resize: 拉高视窗后截图；full_page: 直接截取元素全貌；
+            # sections: 按区块截图并按内容哈希缓存，刷新时只重新截取变化的区块
+            capture_mode='sections',
+            max_age_hours=24,             # 快照有效期（小时）
+            memory_cache_mb=64,           # 内存中已编码快照的总大小上限
+            # 输出编码：format 可选 JPEG / WEBP；target_bytes 为上传大小限制，超出时自动降质或缩放
+            image_encoding=ImageEncoding(
+                format='JPEG', quality=90, progressive=True,
+                target_bytes=10 * 1024 * 1024
+            ),
+            image_workers=2,              # 图片编码线程数
+            snapshot_disk_mb=512,         # 磁盘快照总大小上限
+            snapshot_max_age_days=7,      # 磁盘快照最长保留天数
+            asset_cache_mb=256,           # 渲染用静态资源缓存上限
+            asset_allowed_hosts=('homdgcat.wiki',),  # 允许访问的站点，其余第三方请求一律拦截
+            section_cache_mb=256,         # 区块截图缓存上限（仅 sections 模式）
+            delivery_mode='slices',       # single: 一张长图；slices: 按手机屏幕比例切成多张图片发送
+            slice_aspect=2.0,             # 分片高宽比
+            slice_overlap=50,             # 相邻分片的重叠像素
+            # 快照过期后的内容探测：page 比对页面内容哈希；source 先比对 Avatar.js 条目（不打开浏览器）；None 不探测
+            freshness_probe='page',
+            render_engine='browser',      # browser: 浏览器截图；card: 直接由 Avatar.js 数据绘制卡片（几十毫秒）
+            card_fallback=True,           # 浏览器不可用或渲染失败时改发卡片
+            card_font_path=None,          # 卡片使用的中文字体，None 时自动查找系统字体
+            # 渲染子进程数：大于 0 时浏览器在独立进程中运行，崩溃、卡死或内存泄漏时自动重启；0 为在本进程内渲染
+            render_workers=1,
+            worker_max_jobs=200,          # 子进程执行多少个任务后回收重启
+            worker_max_rss_mb=1536        # 子进程（含浏览器）总内存超过该值时回收重启
+        )
+        # 角色索引：Avatar.js 解析结果持久化在插件目录，过期后后台重新验证
+        plugin_dir = os.path.dirname(os.path.abspath(__file__))
+        self.char_index = CharacterIndex(
+            cache_path=os.path.join(plugin_dir, 'avatar_index.json'),
+            ttl_seconds=3600,
+            aliases_path=os.path.join(plugin_dir, 'aliases.json'),  # 别名配置 {别名: 角色名}
+            fuzzy_threshold=0.6           # 模糊匹配的最低相似度，低于该值只给出候选
+        )
+        # 卡片渲染与 freshness_probe='source' 都需要 Avatar.js 中的角色数据
+        self.char_manager.char_index = self.char_index
+        # 渲染准入控制：缓存命中不排队，渲染受并发、队列长度与频率限制
+        self.render_scheduler = RenderScheduler(
+            max_concurrency=1,            # 同时进行的渲染数，建议与浏览器池大小一致
+            max_queue=10,                 # 等待队列长度，超出后直接拒绝
+            user_rate_per_minute=3,       # 每个用户每分钟可触发的渲染数
+            user_burst=3,
+            group_rate_per_minute=10,     # 每个群每分钟可触发的渲染数
+            group_burst=10
+        )
+        # 准入控制的排队与拒绝计数一并导出到指标快照
+        self.char_manager.render_scheduler = self.render_scheduler
+        # 后台预热：在快照过期前重新渲染热门角色，用户请求优先
+        self.prewarm = PrewarmScheduler(
+            self.char_manager,
+            self.char_index,
+            render_scheduler=self.render_scheduler,  # 后台渲染经由准入控制排队，优先级低于用户请求
+            concurrency=1,            # 后台同时渲染的角色数
+            top_n=30,                 # 只预热请求最多的前 N 个角色，None 表示全部
+            refresh_margin_hours=2,   # 距离过期多久开始刷新
+            scan_interval=600,        # 扫描间隔（秒），实际间隔带随机抖动
+            jitter_seconds=120,       # 每个任务的随机延后上限（秒）
+            quiet_hours=(3, 7)        # 只在该时段内刷新，None 表示不限时段
+        )
         self.playwright_ready = False  # 标记 playwright 是否准备就绪
         self.executor = ThreadPoolExecutor(max_workers=1)
         # 启动异步初始化任务
@@ -26,102 +101,91 @@ class StarRailCharacterPlugin(BasePlugin):
 
     async def initialize(self):
         """异步初始化 playwright"""
+        # 各组件的日志统一输出到宿主的日志器
+        self.char_manager.set_logger(self.ap.logger)
+        self.char_index.logger = self.ap.logger
+        self.prewarm.logger = self.ap.logger
+        self.render_scheduler.logger = self.ap.logger
+
+        # 角色索引不依赖浏览器，先在后台预热
+        if self.char_index.is_stale:
+            asyncio.create_task(self.char_index.refresh())
+
         try:
-            self.ap.logger.info("开始安装 playwright webkit...")
-            
-            # 先安装 webkit 驱动
-            result = await asyncio.get_event_loop().run_in_executor(
-                self.executor,
-                lambda: subprocess.run(
-                    #['playwright', 'install', 'webkit'],
-                    ['playwright', 'install', 'firefox'],
-                    capture_output=True,
-                    text=True
-                )
-            )
-            
-            # 检查安装结果
-            if result.returncode != 0:
-                self.ap.logger.error(f"webkit 安装失败: {result.stderr}")
-                return
-                
-            self.ap.logger.info("webkit 驱动安装成功")
-            
-            # 检查浏览器是否可用
-            try:
-                async with async_playwright() as p:
-                    #browser = await p.webkit.launch(headless=True)
-                    browser = await p.firefox.launch(headless=True)
-                    await browser.close()
-                    self.playwright_ready = True
-                    self.ap.logger.info("firefox 浏览器测试成功")
-            except Exception as e:
-                self.ap.logger.error(f"firefox 浏览器测试失败: {e}")
-                # 尝试安装系统依赖
-                self.ap.logger.info("尝试安装系统依赖...")
+            # 浏览器与当前 playwright 版本匹配时跳过安装，直接报告就绪
+            if not bootstrap.firefox_installed():
+                self.ap.logger.info("开始安装 playwright firefox...")
                 result = await asyncio.get_event_loop().run_in_executor(
-                    self.executor,
-                    lambda: subprocess.run(
-                        ['playwright', 'install-deps', 'firefox'],
-                        capture_output=True,
-                        text=True
-                    )
+                    self.executor, bootstrap.install_firefox
                 )
                 if result.returncode != 0:
-                    self.ap.logger.error(f"系统依赖安装失败: {result.stderr}")
-                else:
-                    self.ap.logger.info("系统依赖安装成功")
-                    self.playwright_ready = True
-                    
+                    self.ap.logger.error(f"firefox 安装失败: {result.stderr}")
+                    return
+                self.ap.logger.info("firefox 安装成功")
+
+            self.playwright_ready = True
+            self.ap.logger.info("崩铁爬虫插件已就绪")
+            # 浏览器池在后台预热，首个渲染请求会等待其启动完成
+            asyncio.create_task(self.warm_up())
         except Exception as e:
             self.ap.logger.error(f"初始化 playwright 时出错: {e}")
 
-    async def get_character_id(self, character_name):
-        """根据角色名从Avatar.js中获取角色ID"""
+    async def warm_up(self):
+        """后台启动浏览器池；启动失败时尝试安装系统依赖后重试"""
         try:
-            response = requests.get("https://homdgcat.wiki/data/CH/Avatar.js")
-            content = response.text
-            
-            # 定位 _avatar 变量的内容
-            avatar_start = content.find("var _avatar = [")
-            if avatar_start == -1:
-                self.ap.logger.error("未找到 _avatar 变量")
-                return None
-                
-            # 找到下一个变量定义的位置
-            next_var = content.find("var _", avatar_start + 13)  # 跳过当前的 "var _avatar = ["
-            if next_var == -1:
-                self.ap.logger.error("未找到下一个变量定义")
-                return None
-                
-            # 向前查找最后一个 "]"
-            avatar_end = content.rfind("]", avatar_start, next_var)
-            if avatar_end == -1:
-                self.ap.logger.error("未找到 _avatar 数组的结束位置")
-                return None
-                
-            # 提取 JSON 数组内容
-            avatar_json = content[avatar_start + 13:avatar_end + 1]
-            
-            # 解析 JSON
-            avatar_data = json.loads(avatar_json)
-            
-            # 查找匹配的角色
-            for character in avatar_data:
-                if character["Name"] == character_name:
-                    return character["_id"]
-                    
-            self.ap.logger.info(f"未找到角色: {character_name}")
-            return None
-            
+            await self.char_manager.start()
+            self.prewarm.start()
+            self.ap.logger.info("firefox 浏览器池启动成功")
+            return
+        except Exception as e:
+            self.ap.logger.error(f"firefox 浏览器池启动失败: {e}")
+
+        self.playwright_ready = False
+        bootstrap.invalidate_firefox()
+        self.ap.logger.info("尝试重新安装 firefox 及系统依赖...")
+        loop = asyncio.get_event_loop()
+        result = await loop.run_in_executor(self.executor, bootstrap.install_firefox)
+        if result.returncode != 0:
+            self.ap.logger.error(f"firefox 安装失败: {result.stderr}")
+            return
+        result = await loop.run_in_executor(self.executor, bootstrap.install_firefox_deps)
+        if result.returncode != 0:
+            self.ap.logger.error(f"系统依赖安装失败: {result.stderr}")
+            return
+        self.ap.logger.info("系统依赖安装成功")
+        try:
+            await self.char_manager.start()
+            self.playwright_ready = True
+            self.prewarm.start()
+            self.ap.logger.info("firefox 浏览器池启动成功")
+        except Exception as e:
+            self.ap.logger.error(f"firefox 浏览器池启动失败: {e}")
+
+    async def resolve_character(self, character_name):
+        """把用户输入解析为角色（支持别名、拼音与错别字），出错时返回 None"""
+        try:
+            lookup_start = time.time()
+            resolution = await self.char_index.resolve(character_name)
+            self.char_manager.metrics.observe('index_lookup', time.time() - lookup_start)
+            if not resolution:
+                self.ap.logger.info(f"未找到角色: {character_name}")
+            elif resolution.method != 'name':
+                self.ap.logger.info(f"角色名 {character_name} 通过{resolution.method}匹配为 {resolution.name}")
+            return resolution
         except Exception as e:
             self.ap.logger.error(f"获取角色ID时出错: {e}")
             return None
 
+    async def get_character_id(self, character_name):
+        """根据角色名从角色索引中获取角色ID"""
+        resolution = await self.resolve_character(character_name)
+        return resolution.char_id if resolution else None
+
     @handler(PersonNormalMessageReceived)
     @handler(GroupNormalMessageReceived)
     async def on_message(self, ctx: EventContext):
-        if not self.playwright_ready:
+        # 允许卡片兜底时，浏览器就绪前的查询直接改发卡片
+        if not self.playwright_ready and not self.char_manager.card_fallback:
             ctx.add_return('reply', [mirai.Plain("插件正在初始化中，请稍后再试...")])
             ctx.prevent_default()
             return
@@ -134,18 +198,65 @@ class StarRailCharacterPlugin(BasePlugin):
         if match:
             if match.group(0) == "崩铁爬虫帮助":
                 await self.send_help(ctx)
+            elif match.group(0) == "崩铁爬虫状态":
+                await self.send_status(ctx)
             else:            
-                character_name = match.group(1)
-                # 获取角色ID
-                char_id = await self.get_character_id(character_name)
-                if not char_id:
-                    ctx.add_return('reply', [mirai.Plain("未找到该角色ID。")])
+                # 解析角色，后续缓存均以角色ID为键，与用户输入的写法无关
+                resolution = await self.resolve_character(match.group(2).strip())
+                if not resolution:
+                    reply = "未找到该角色ID。"
+                    if resolution is not None and resolution.suggestions:
+                        reply += f"你是不是想找：{'、'.join(resolution.suggestions)}？"
+                    ctx.add_return('reply', [mirai.Plain(reply)])
+                    ctx.prevent_default()
+                    return
+                char_id, character_name = resolution.char_id, resolution.name
+
+                # 卡片不需要浏览器，几十毫秒即可生成，不经过准入控制
+                if match.group(1) or self.char_manager.render_engine == 'card' or not self.playwright_ready:
+                    card = await self.char_manager.get_character_card(char_id)
+                    if card is not None:
+                        ctx.add_return('reply', [card])
+                    elif not self.playwright_ready:
+                        ctx.add_return('reply', [mirai.Plain("插件正在初始化中，请稍后再试...")])
+                    else:
+                        ctx.add_return('reply', [mirai.Plain("生成角色卡片失败。")])
+                    ctx.prevent_default()
+                    return
+
+                # 获取角色快照：缓存命中直接返回，否则经过准入控制后渲染
+                event = ctx.event
+                group_key = event.launcher_id if getattr(event, 'launcher_type', None) == 'group' else None
+
+                async def notify_queued(position):
+                    await ctx.reply(mirai.MessageChain([mirai.Plain(f"正在排队渲染，前面还有 {position - 1} 个任务...")]))
+
+                # 分片模式下第一片先行发出，其余分片随最终回复发送
+                sent_slices = []
+
+                async def send_first_slice(image):
+                    await ctx.reply(mirai.MessageChain([image]))
+                    sent_slices.append(image)
+
+                try:
+                    image_data = await self.render_scheduler.submit(
+                        self.char_manager, char_id, character_name,
+                        user_key=getattr(event, 'sender_id', None),
+                        group_key=group_key,
+                        on_queued=notify_queued,
+                        on_first_slice=send_first_slice
+                    )
+                except RenderRejected as e:
+                    ctx.add_return('reply', [mirai.Plain(str(e))])
                     ctx.prevent_default()
                     return
 
-                # 获取角色快照
-                image_data = await self.char_manager.get_character_snapshot(char_id, character_name)
-                if image_data:
+                if isinstance(image_data, list):
+                    # 只有一片时它已经提前发出，无需再回复
+                    remaining = image_data[len(sent_slices):]
+                    if remaining:
+                        ctx.add_return('reply', remaining)
+                elif image_data:
                     ctx.add_return('reply', [image_data])
                 else:
                     ctx.add_return('reply', [mirai.Plain("获取角色快照失败。")])
@@ -159,12 +270,61 @@ class StarRailCharacterPlugin(BasePlugin):
             "崩坏：星穹铁道角色信息查询插件使用说明：\n"
             "1. 输入 '爬取崩铁：角色名' 来查询角色信息。\n"
             "   例如：爬取崩铁：希儿\n"
-            "2. 角色名应为1-5个字符。\n"
+            "   输入 '爬取崩铁卡片：角色名' 可跳过网页截图，直接生成资料卡片（更快）。\n"
+            "2. 角色名最长20个字符，支持常用别名、拼音（如 xier）和简单的错别字。\n"
             "3. 信息包括角色基本信息、描述和技能列表。\n"
-            "4. 输入 '崩铁爬虫帮助' 显示此帮助信息。"
+            "4. 输入 '崩铁爬虫帮助' 显示此帮助信息。\n"
+            "5. 输入 '崩铁爬虫状态' 查看渲染耗时与缓存命中情况。"
         )
         ctx.add_return('reply', [mirai.Plain(help_text)])
         ctx.prevent_default()
+
+    async def send_status(self, ctx: EventContext):
+        """回复各阶段耗时、缓存命中率与浏览器状态，并导出完整的指标快照"""
+        metrics_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metrics.json')
+        snapshot = await self.char_manager.export_metrics(metrics_path)
+        memory_cache = snapshot['memory_cache']
+        counters = snapshot['counters']
+        requests = counters.get('requests', 0)
+        hits = counters.get('memory_hits', 0) + counters.get('disk_hits', 0)
+        rss = snapshot['browser_pool']['rss_bytes']
+
+        lines = ["崩铁爬虫状态："]
+        lines.append(f"请求 {requests} 次，缓存命中率 {hits / requests:.0%}" if requests else "暂无请求")
+        lines.append(f"内存缓存 {memory_cache['entries']} 项 / {memory_cache['bytes'] / 1024 / 1024:.1f}MB，"
+                     f"命中率 {memory_cache['hit_ratio']:.0%}，淘汰 {memory_cache['evictions']} 次")
+        lines.append(f"渲染 {counters.get('renders', 0)} 次，失败 {counters.get('render_failures', 0)} 次，"
+                     f"合并 {counters.get('coalesced', 0)} 次，卡片 {counters.get('card_renders', 0)} 次"
+                     f"（兜底 {counters.get('card_fallbacks', 0)} 次）")
+        lines.append(f"内容未变化免渲染 {counters.get('renders_avoided', 0)} 次"
+                     f"（Avatar.js {counters.get('unchanged_source', 0)} 次，页面 {counters.get('unchanged_page', 0)} 次）")
+        scheduler = snapshot['render_scheduler']
+        lines.append(f"进行中 {snapshot['inflight_renders']}，排队 {scheduler['waiting']}/{scheduler['max_queue']}，"
+                     f"限流拒绝 {scheduler['rate_limited']} 次，队满拒绝 {scheduler['queue_rejected']} 次")
+        section_cache = snapshot['section_cache']
+        if section_cache is not None:
+            lines.append(f"区块缓存 {section_cache['entries']} 项 / {section_cache['bytes'] / 1024 / 1024:.1f}MB，"
+                         f"新截取 {section_cache['captured']} 个，复用 {section_cache['reused']} 个")
+        if rss is not None:
+            lines.append(f"浏览器内存 {rss / 1024 / 1024:.0f}MB，已回收 {snapshot['browser_pool']['recycled']} 次")
+        if 'crashes' in snapshot['browser_pool']:
+            lines.append(f"渲染子进程 {snapshot['browser_pool']['size']} 个，崩溃 {snapshot['browser_pool']['crashes']} 次，"
+                         f"超时 {snapshot['browser_pool']['timeouts']} 次")
+        for stage, stats in snapshot['stages'].items():
+            lines.append(f"{stage}: p50 {stats['p50_ms']:.0f}ms / p95 {stats['p95_ms']:.0f}ms (n={stats['count']})")
+        ctx.add_return('reply', [mirai.Plain("\n".join(lines))])
+        ctx.prevent_default()
     
+    async def destroy(self):
+        """插件卸载时停止后台预热并关闭浏览器池"""
+        self.playwright_ready = False
+        await self.prewarm.stop()
+        await self.char_manager.close()
+
     def __del__(self):
-        pass
+        # 兜底：宿主未调用 destroy 时，尽量在事件循环中关闭浏览器池
+        if self.char_manager.render_pool.started:
+            try:
+                asyncio.get_event_loop().create_task(self.char_manager.close())
+            except Exception:
+                pass
@@ -0,0 +1,84 @@
+import time
+import bisect
+from collections import deque
+
+
+# 延迟直方图的桶上界（毫秒）
+DEFAULT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 20000, 40000, 60000)
+
+# 渲染器内部的等待阶段，汇总为 readiness
+READINESS_STAGES = ('content', 'sections_stable', 'images', 'fonts', 'network_idle')
+
+
+class Histogram:
+    """固定桶的延迟直方图，另保留最近的样本用于计算分位数"""
+
+    def __init__(self, buckets_ms=DEFAULT_BUCKETS_MS, recent=512):
+        self.buckets_ms = tuple(buckets_ms)
+        self.counts = [0] * (len(self.buckets_ms) + 1)  # 最后一个桶为 +Inf
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+        self.recent = deque(maxlen=recent)
+
+    def observe(self, seconds):
+        value = seconds * 1000
+        self.counts[bisect.bisect_left(self.buckets_ms, value)] += 1
+        self.count += 1
+        self.sum_ms += value
+        self.max_ms = max(self.max_ms, value)
+        self.recent.append(value)
+
+    def percentile(self, p):
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "avg_ms": round(self.sum_ms / self.count, 2) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50), 2),
+            "p95_ms": round(self.percentile(95), 2),
+            "max_ms": round(self.max_ms, 2),
+            "buckets": {
+                **{f"le_{b}": c for b, c in zip(self.buckets_ms, self.counts)},
+                "le_inf": self.counts[-1],
+            },
+        }
+
+
+class Metrics:
+    """插件的指标集合：分阶段延迟直方图与计数器"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, stage, seconds):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram()
+        histogram.observe(seconds)
+
+    def observe_render(self, timings):
+        """记录一次渲染的各阶段耗时，渲染器内部的等待阶段合并为 readiness"""
+        readiness = 0.0
+        for stage, seconds in timings.items():
+            if stage in READINESS_STAGES:
+                readiness += seconds
+            else:
+                self.observe(stage, seconds)
+        self.observe('readiness', readiness)
+
+    def incr(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        return {
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "stages": {stage: h.snapshot() for stage, h in self.histograms.items()},
+            "counters": dict(self.counters),
+        }
@@ -0,0 +1,156 @@
+import json
+import logging
+import unicodedata
+from collections import defaultdict
+
+
+def normalize(text):
+    """全角转半角、去空白、转小写，使 "希儿"、" 希儿 "、"ＳＥＥＬＥ" 之类的写法一致"""
+    text = unicodedata.normalize('NFKC', text or '')
+    return ''.join(text.split()).lower()
+
+
+def _is_ascii(text):
+    return all(ord(ch) < 128 for ch in text)
+
+
+def ngrams(key):
+    """中文按单字与双字切分，拼音等 ASCII 串按三字切分"""
+    if _is_ascii(key):
+        padded = f"^{key}$"
+        return {padded[i:i + 3] for i in range(max(1, len(padded) - 2))}
+    grams = set(key)
+    grams.update(key[i:i + 2] for i in range(len(key) - 1))
+    return grams
+
+
+def _load_pinyin():
+    """pypinyin 为可选依赖，未安装时不做拼音匹配"""
+    try:
+        from pypinyin import lazy_pinyin, Style
+    except ImportError:
+        return None
+
+    def to_pinyin(name):
+        full = ''.join(lazy_pinyin(name))
+        initials = ''.join(lazy_pinyin(name, style=Style.FIRST_LETTER))
+        return full.lower(), initials.lower()
+    return to_pinyin
+
+
+class Resolution:
+    """名称解析结果；char_id 为 None 时 suggestions 给出候选名称"""
+
+    def __init__(self, char_id=None, name=None, method=None, suggestions=None):
+        self.char_id = char_id
+        self.name = name
+        self.method = method
+        self.suggestions = suggestions or []
+
+    def __bool__(self):
+        return self.char_id is not None
+
+
+class NameIndex:
+    """由 Avatar.js 一次性构建的角色名索引：正式名、别名、拼音与 n-gram 模糊匹配"""
+
+    def __init__(self, characters, aliases=None, fuzzy_threshold=0.6, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.fuzzy_threshold = fuzzy_threshold
+        self.exact = {}                     # 归一化后的键 -> 角色ID
+        self.names = {}                     # 角色ID -> 正式名
+        self.methods = {}                   # 归一化后的键 -> 匹配方式
+        self.grams = defaultdict(set)       # n-gram -> 键
+        self.key_grams = {}                 # 键 -> n-gram 集合
+
+        for character in characters:
+            char_id = str(character.get('_id', ''))
+            name = character.get('Name')
+            if not char_id or not name:
+                continue
+            # 同名角色（如多个开拓者）保留第一个
+            if char_id not in self.names and normalize(name) not in self.exact:
+                self.names[char_id] = name
+                self._add(name, char_id, 'name')
+
+        self.to_pinyin = to_pinyin = _load_pinyin()
+        if to_pinyin is not None:
+            for char_id, name in list(self.names.items()):
+                full, initials = to_pinyin(name)
+                self._add(full, char_id, 'pinyin')
+                if len(initials) >= 2:
+                    self._add(initials, char_id, 'initials')
+
+        by_name = {normalize(name): char_id for char_id, name in self.names.items()}
+        for alias, target in (aliases or {}).items():
+            char_id = str(target) if str(target) in self.names else by_name.get(normalize(str(target)))
+            if char_id is None:
+                self.logger.warning(f"别名 {alias} 指向的角色 {target} 不存在，已忽略")
+                continue
+            self._add(alias, char_id, 'alias')
+
+    def _add(self, key, char_id, method):
+        key = normalize(key)
+        if not key or key in self.exact:
+            return
+        self.exact[key] = char_id
+        self.methods[key] = method
+        grams = ngrams(key)
+        self.key_grams[key] = grams
+        for gram in grams:
+            self.grams[gram].add(key)
+
+    def _fuzzy(self, query):
+        """按 n-gram 的 Dice 系数打分，返回按分数降序的 (分数, 角色ID)，每个角色只保留最高分"""
+        query_grams = ngrams(query)
+        overlap = defaultdict(int)
+        for gram in query_grams:
+            for key in self.grams.get(gram, ()):
+                overlap[key] += 1
+
+        best = {}
+        for key, shared in overlap.items():
+            score = 2 * shared / (len(query_grams) + len(self.key_grams[key]))
+            char_id = self.exact[key]
+            if score > best.get(char_id, 0):
+                best[char_id] = score
+        return sorted(((score, char_id) for char_id, score in best.items()), reverse=True)
+
+    def resolve(self, query, suggestions=3):
+        """解析用户输入；唯一且足够相似的模糊结果直接采用，否则返回候选"""
+        key = normalize(query)
+        if not key:
+            return Resolution()
+        char_id = self.exact.get(key)
+        if char_id is not None:
+            return Resolution(char_id, self.names[char_id], self.methods[key])
+
+        ranked = self._fuzzy(key)
+        if self.to_pinyin is not None and not _is_ascii(key):
+            # 同音错字（如 希尔 -> 希儿）按拼音匹配
+            full, _ = self.to_pinyin(key)
+            char_id = self.exact.get(full)
+            if char_id is not None:
+                return Resolution(char_id, self.names[char_id], 'homophone')
+            scores = dict((cid, score) for score, cid in ranked)
+            for score, cid in self._fuzzy(full):
+                scores[cid] = max(score, scores.get(cid, 0))
+            ranked = sorted(((score, cid) for cid, score in scores.items()), reverse=True)
+        if ranked:
+            top_score, top_id = ranked[0]
+            runner_up = ranked[1][0] if len(ranked) > 1 else 0
+            if top_score >= self.fuzzy_threshold and top_score > runner_up:
+                return Resolution(top_id, self.names[top_id], 'fuzzy')
+        return Resolution(suggestions=[self.names[char_id] for _, char_id in ranked[:suggestions]])
+
+
+def load_aliases(path, logger=None):
+    """读取别名配置 {别名: 角色名或角色ID}，文件不存在时返回空字典"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        (logger or logging.getLogger(__name__)).warning(f"读取别名配置失败: {e}")
+        return {}
@@ -0,0 +1,152 @@
+import time
+import logging
+import random
+import asyncio
+from datetime import datetime, timedelta
+
+
+class PrewarmScheduler:
+    """后台预热调度器：在快照过期前按热度挑选角色重新渲染，用户请求优先"""
+
+    def __init__(self, char_manager, char_index, render_scheduler=None, concurrency=1, top_n=None,
+                 refresh_margin_hours=2, scan_interval=600, jitter_seconds=120,
+                 quiet_hours=None, idle_poll_interval=1.0, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.char_manager = char_manager
+        self.char_index = char_index
+        # 配置了准入控制时后台渲染经由它排队，优先级低于用户请求
+        self.render_scheduler = render_scheduler
+        self.concurrency = max(1, int(concurrency))
+        self.top_n = top_n                      # None 表示预热全部角色
+        self.refresh_margin_hours = refresh_margin_hours
+        self.scan_interval = scan_interval
+        self.jitter_seconds = jitter_seconds
+        self.quiet_hours = quiet_hours          # (开始小时, 结束小时)，None 表示不限时段
+        self.idle_poll_interval = idle_poll_interval
+        self._task = None
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.rendered = 0
+        self.failed = 0
+        self.last_scan_at = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def in_quiet_hours(self, now=None):
+        """当前是否处于允许后台刷新的时段，窗口可以跨越午夜"""
+        if not self.quiet_hours:
+            return True
+        start, end = self.quiet_hours
+        hour = (now or datetime.now()).hour
+        if start <= end:
+            return start <= hour < end
+        return hour >= start or hour < end
+
+    def next_window_start(self, now=None):
+        """下一个刷新时段的开始时间戳；当前已在时段内时为之后的那一个，不限时段时返回 None"""
+        if not self.quiet_hours:
+            return None
+        now = now or datetime.now()
+        start = now.replace(hour=self.quiet_hours[0], minute=0, second=0, microsecond=0)
+        if start <= now:
+            start += timedelta(days=1)
+        return start.timestamp()
+
+    def due_characters(self, now=None):
+        """挑选需要预热的 (角色ID, 角色名)，热门角色排在前面
+
+        距离过期不足 refresh_margin_hours，或者会在下一个刷新时段开始前过期的快照都需要刷新。
+        """
+        candidates = []
+        for character in self.char_index.characters:
+            char_id = str(character.get('_id', ''))
+            name = character.get('Name')
+            if char_id and name:
+                candidates.append((char_id, name))
+
+        counts = self.char_manager.request_counts
+        candidates.sort(key=lambda item: counts[item[0]], reverse=True)
+        if self.top_n:
+            # 只预热确实有人请求过的角色，没有请求记录时不按 Avatar.js 的顺序凑数
+            candidates = [item for item in candidates[:self.top_n] if counts[item[0]] > 0]
+
+        max_age = self.char_manager.max_age_hours * 3600
+        margin = self.refresh_margin_hours * 3600
+        now = now or datetime.now()
+        timestamp = now.timestamp()
+        next_window = self.next_window_start(now)
+        due = []
+        for char_id, name in candidates:
+            rendered_at = self.char_manager.snapshot_rendered_at(char_id)
+            if rendered_at is None:
+                due.append((char_id, name))
+                continue
+            expires_at = rendered_at + max_age
+            if timestamp >= expires_at - margin or (next_window is not None and expires_at <= next_window):
+                due.append((char_id, name))
+        return due
+
+    async def _run(self):
+        while True:
+            # 扫描间隔加入随机抖动，避免多个实例同时刷新
+            await asyncio.sleep(self.scan_interval * random.uniform(0.8, 1.2))
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"后台预热出错: {e}")
+
+    async def run_once(self):
+        """执行一轮预热"""
+        self.last_scan_at = time.time()
+        # 顺带持久化请求计数，重启后仍能按热度挑选角色
+        await self.char_manager.save_request_counts()
+        if not self.in_quiet_hours():
+            return
+        await self.char_index.ensure_loaded()
+        due = self.due_characters()
+        if not due:
+            return
+        self.logger.info(f"后台预热：{len(due)} 个角色待刷新")
+        await asyncio.gather(*(self._prerender(char_id, name) for char_id, name in due))
+
+    async def _prerender(self, char_id, name):
+        # 每个任务随机延后，让刷新分散开而不是同时落地
+        await asyncio.sleep(random.uniform(0, self.jitter_seconds))
+        async with self._semaphore:
+            if not self.in_quiet_hours():
+                return
+            await self._wait_for_user_idle()
+            if self.render_scheduler is not None:
+                ok = await self.render_scheduler.prerender(self.char_manager, char_id, name)
+            else:
+                ok = await self.char_manager.prerender(char_id, name)
+            if ok:
+                self.rendered += 1
+            else:
+                self.failed += 1
+
+    async def _wait_for_user_idle(self):
+        """有用户请求在等待渲染时暂停后台任务"""
+        while self.char_manager.user_renders > 0:
+            await asyncio.sleep(self.idle_poll_interval)
+
+    def stats(self):
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "rendered": self.rendered,
+            "failed": self.failed,
+            "last_scan_at": self.last_scan_at,
+        }
@@ -0,0 +1,209 @@
+import time
+import asyncio
+import logging
+from collections import deque
+
+
+class RenderRejected(Exception):
+    """渲染请求被准入控制拒绝"""
+
+
+class RateLimited(RenderRejected):
+    """请求过于频繁"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"请求过于频繁，请 {retry_after:.0f} 秒后再试")
+        self.retry_after = retry_after
+
+
+class QueueFull(RenderRejected):
+    """渲染队列已满"""
+
+    def __init__(self):
+        super().__init__("当前渲染任务过多，请稍后再试")
+
+
+class TokenBucket:
+    """令牌桶：rate 为每秒补充的令牌数，capacity 为突发上限"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def retry_after(self):
+        """距离有一个可用令牌还需等待的秒数，0 表示现在就有"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate else float('inf')
+
+    def consume(self):
+        self._refill()
+        self.tokens -= 1
+
+    @property
+    def full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class RenderScheduler:
+    """渲染准入控制：限制并发渲染数、有界等待队列，以及按用户/群的令牌桶限流
+
+    缓存命中与已在进行中的同角色渲染不占用渲染名额，也不消耗令牌。
+    """
+
+    def __init__(self, max_concurrency=1, max_queue=10, user_rate_per_minute=3, user_burst=3,
+                 group_rate_per_minute=10, group_burst=10, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_queue = max_queue
+        self.user_limit = (user_rate_per_minute / 60, user_burst)
+        self.group_limit = (group_rate_per_minute / 60, group_burst)
+        self._user_buckets = {}
+        self._group_buckets = {}
+        self._running = 0
+        self._waiters = deque()
+        # 后台预渲染的等待队列，只有在没有用户请求等待时才能拿到名额
+        self._background_waiters = deque()
+        self.rate_limited = 0
+        self.queue_rejected = 0
+        self.queued = 0
+
+    def _bucket(self, buckets, key, limit):
+        bucket = buckets.get(key)
+        if bucket is None:
+            # 清理已经回满的桶，避免长期运行后字典无限增长
+            if len(buckets) > 1024:
+                for stale in [k for k, b in buckets.items() if b.full]:
+                    del buckets[stale]
+            bucket = buckets[key] = TokenBucket(*limit)
+        return bucket
+
+    def check_rate(self, user_key=None, group_key=None):
+        """同时检查用户与群的令牌桶，都有令牌时才一起扣除，否则抛出 RateLimited"""
+        buckets = []
+        if user_key is not None:
+            buckets.append(self._bucket(self._user_buckets, user_key, self.user_limit))
+        if group_key is not None:
+            buckets.append(self._bucket(self._group_buckets, group_key, self.group_limit))
+        retry_after = max((bucket.retry_after() for bucket in buckets), default=0.0)
+        if retry_after > 0:
+            self.rate_limited += 1
+            raise RateLimited(retry_after)
+        for bucket in buckets:
+            bucket.consume()
+
+    async def _acquire(self, on_queued=None, background=False):
+        """获取渲染名额；background 为 True 时排在所有用户请求之后，且不受队列长度限制"""
+        if background:
+            waiters = self._background_waiters
+            idle = not self._waiters and not self._background_waiters
+        else:
+            waiters = self._waiters
+            idle = not self._waiters
+        if self._running < self.max_concurrency and idle:
+            self._running += 1
+            return
+        if not background:
+            self._check_capacity()
+
+        waiter = asyncio.get_event_loop().create_future()
+        waiters.append(waiter)
+        if not background:
+            self.queued += 1
+        # 位置包含正在进行的渲染：只有一个名额且已被占用时，第一个排队者的位置是 2
+        position = self._running + len(waiters)
+        try:
+            if on_queued is not None:
+                try:
+                    await on_queued(position)
+                except Exception as e:
+                    self.logger.warning(f"发送排队提示失败: {e}")
+            await waiter
+        except asyncio.CancelledError:
+            if waiter in waiters:
+                waiters.remove(waiter)
+            elif waiter.done() and not waiter.cancelled():
+                # 名额已经交给了这个等待者，转交给下一个
+                self._release()
+            raise
+
+    def _check_capacity(self):
+        """需要排队而等待队列已满时抛出 QueueFull"""
+        if self._running >= self.max_concurrency or self._waiters:
+            if len(self._waiters) >= self.max_queue:
+                self.queue_rejected += 1
+                raise QueueFull()
+
+    def _release(self):
+        # 用户请求优先，其次才是后台预渲染
+        for waiters in (self._waiters, self._background_waiters):
+            while waiters:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    # 名额直接转交，_running 保持不变
+                    waiter.set_result(None)
+                    return
+        self._running -= 1
+
+    async def submit(self, char_manager, character_id, character_name=None,
+                     user_key=None, group_key=None, on_queued=None, on_first_slice=None):
+        """获取角色快照；缓存命中直接返回，否则经过限流与排队后渲染
+
+        被拒绝时抛出 RenderRejected；on_queued(position) 在需要排队时被调用一次，
+        position 从正在进行的渲染算起（前面有 position - 1 个任务），
+        on_first_slice(image) 在分片模式下第一片就绪时被调用。
+        """
+        cached = await char_manager.get_cached_snapshot(character_id)
+        if cached:
+            return cached
+        if char_manager.is_rendering(character_id):
+            # 已有同角色的渲染在进行，直接等待共享结果
+            return await char_manager.render_snapshot(character_id, character_name, on_first_slice)
+
+        # 先确认队列还有空位再扣令牌，被队满拒绝的请求不消耗频率额度；
+        # 两次检查与 _acquire 之间没有 await，队列状态不会变化
+        self._check_capacity()
+        self.check_rate(user_key, group_key)
+        await self._acquire(on_queued)
+        try:
+            # 排队期间可能已被其他请求渲染好
+            cached = await char_manager.get_cached_snapshot(character_id, count_request=False)
+            if cached:
+                return cached
+            return await char_manager.render_snapshot(character_id, character_name, on_first_slice)
+        finally:
+            self._release()
+
+    async def prerender(self, char_manager, character_id, character_name):
+        """后台预渲染：以低于用户请求的优先级占用渲染名额，不限流；成功返回 True
+
+        已有同角色的渲染在进行时直接等待其结果，不再占用名额。
+        """
+        if char_manager.is_rendering(character_id):
+            return await char_manager.prerender(character_id, character_name)
+        await self._acquire(background=True)
+        try:
+            return await char_manager.prerender(character_id, character_name)
+        finally:
+            self._release()
+
+    def stats(self):
+        return {
+            "running": self._running,
+            "waiting": len(self._waiters),
+            "background_waiting": len(self._background_waiters),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queued": self.queued,
+            "rate_limited": self.rate_limited,
+            "queue_rejected": self.queue_rejected,
+        }
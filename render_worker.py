@@ -0,0 +1,484 @@
+import os
+import sys
+import json
+import time
+import base64
+import signal
+import asyncio
+import logging
+import threading
+from .browser_pool import BrowserPool, process_descendants, process_tree_rss
+from .renderer import PageRenderer, RenderTimeouts, RenderTimeoutError
+from .asset_cache import AssetCache, RenderTraffic
+
+
+# 渲染子进程与插件之间的通信：stdin/stdout 上每行一个 JSON 对象，二进制内容用 base64 编码。
+#   插件 -> 子进程: render / claimed / shutdown
+#   子进程 -> 插件: ready / claim / result / error（ready 与 result 附带子进程的资源缓存统计）
+# 子进程的日志写到 stderr，由插件转发到宿主日志。
+
+
+class WorkerCrashed(Exception):
+    """渲染子进程在任务完成前退出"""
+
+
+def _encode_result(result, traffic):
+    encoded = dict(result)
+    if encoded.get('screenshot') is not None:
+        encoded['screenshot'] = base64.b64encode(encoded['screenshot']).decode('ascii')
+    if encoded.get('bands') is not None:
+        encoded['bands'] = [
+            dict(band, png=base64.b64encode(band['png']).decode('ascii') if band['png'] else None)
+            for band in encoded['bands']
+        ]
+    encoded['traffic'] = traffic.as_dict()
+    return encoded
+
+
+def _decode_result(encoded):
+    result = dict(encoded)
+    traffic = RenderTraffic.from_dict(result.pop('traffic', {}))
+    if result.get('screenshot') is not None:
+        result['screenshot'] = base64.b64decode(result['screenshot'])
+    if result.get('bands') is not None:
+        result['bands'] = [
+            dict(band, png=base64.b64decode(band['png']) if band['png'] else None)
+            for band in result['bands']
+        ]
+    return result, traffic
+
+
+class _WorkerServer:
+    """子进程一侧：常驻一个浏览器池，逐个执行插件发来的渲染任务"""
+
+    def __init__(self, options):
+        self.logger = logging.getLogger('sr-render-worker')
+        self.loop = asyncio.get_event_loop()
+        self.options = options
+        self.pool = BrowserPool(
+            size=1,
+            max_renders_per_browser=options.get('max_renders_per_browser', 50),
+            max_rss_mb=None,  # 内存上限由插件按整个子进程树统一判断
+            logger=self.logger
+        )
+        self.renderer = PageRenderer(
+            viewport_width=options.get('viewport_width', 600),
+            timeouts=RenderTimeouts(**options.get('timeouts', {})),
+            capture_mode=options.get('capture_mode', 'resize'),
+            logger=self.logger
+        )
+        asset_options = options.get('asset_cache') or {}
+        # 每个子进程独占一个缓存子目录，各自的索引与淘汰互不覆盖；按编号区分，重启后沿用
+        self.asset_cache = AssetCache(
+            os.path.join(asset_options['cache_dir'], f"worker-{options.get('worker_index', 0)}"),
+            allowed_hosts=asset_options.get('allowed_hosts', ('homdgcat.wiki',)),
+            max_total_mb=asset_options.get('max_total_mb', 256),
+            logger=self.logger
+        )
+        self.inbox = asyncio.Queue()
+        self._claims = {}
+        self._write_lock = threading.Lock()
+
+    def send(self, message):
+        data = (json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._write_lock:
+            self.stdout.write(data)
+            self.stdout.flush()
+
+    def _read_stdin(self):
+        # Windows 上无法把匿名管道接入事件循环，统一用线程阻塞读取
+        for line in sys.stdin.buffer:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            self.loop.call_soon_threadsafe(self._dispatch, message)
+        self.loop.call_soon_threadsafe(self._dispatch, {'type': 'shutdown'})
+
+    def _dispatch(self, message):
+        if message.get('type') == 'claimed':
+            future = self._claims.pop((message['id'], message['hash']), None)
+            if future is not None and not future.done():
+                future.set_result(bool(message.get('ok')))
+        else:
+            self.inbox.put_nowait(message)
+
+    async def _claim(self, job_id, digest):
+        """询问插件该区块是否已缓存"""
+        future = self.loop.create_future()
+        self._claims[(job_id, digest)] = future
+        self.send({'type': 'claim', 'id': job_id, 'hash': digest})
+        return await future
+
+    async def _render(self, message):
+        job_id = message['id']
+        content_hash = message.get('content_hash')
+        unchanged = (lambda digest: digest == content_hash) if content_hash else None
+        reuse_section = None
+        if message.get('reuse_sections'):
+            reuse_section = lambda digest: self._claim(job_id, digest)
+        try:
+            async with self.pool.context() as context:
+                traffic = await self.asset_cache.install(context)
+                result = await self.renderer.render(context, message['url'], reuse_section, unchanged)
+            self.send({'type': 'result', 'id': job_id, 'result': _encode_result(result, traffic),
+                       'asset_cache': self.asset_cache.stats()})
+        except RenderTimeoutError as e:
+            self.send({'type': 'error', 'id': job_id, 'kind': 'timeout', 'error': str(e)})
+        except Exception as e:
+            self.logger.exception("渲染任务出错")
+            self.send({'type': 'error', 'id': job_id, 'kind': 'error', 'error': f"{type(e).__name__}: {e}"})
+
+    async def serve(self):
+        # 协议独占原来的 stdout，其余输出（包括第三方库的 print）一律改到 stderr
+        self.stdout = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        threading.Thread(target=self._read_stdin, name='sr-worker-stdin', daemon=True).start()
+
+        await self.pool.start()
+        self.send({'type': 'ready', 'pid': os.getpid(), 'asset_cache': self.asset_cache.stats()})
+        try:
+            while True:
+                message = await self.inbox.get()
+                if message.get('type') == 'shutdown':
+                    break
+                if message.get('type') == 'render':
+                    await self._render(message)
+        finally:
+            await self.pool.close()
+
+
+class _Worker:
+    """插件一侧对一个渲染子进程的句柄"""
+
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.jobs = 0
+        self.started_at = None
+        self.ready = None
+        self.pending = None      # (任务ID, future)
+        self.reuse_section = None
+        self.asset_cache = None  # 子进程最近一次上报的资源缓存统计
+        self.readers = []
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.returncode is None
+
+
+class RenderWorkerPool:
+    """在独立的子进程中执行浏览器渲染，插件进程只保留轻量的异步客户端
+
+    子进程崩溃或超出任务截止时间会被杀掉并在后台重启；
+    执行了 max_jobs 个任务或子进程树内存超过 max_rss_mb 时也会回收重启。
+    """
+
+    def __init__(self, size=1, max_jobs=200, max_rss_mb=1536, job_timeout=120, start_timeout=90,
+                 shutdown_timeout=10, worker_options=None, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.size = max(1, int(size))
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.job_timeout = job_timeout
+        self.start_timeout = start_timeout
+        self.shutdown_timeout = shutdown_timeout
+        self.worker_options = worker_options or {}
+        self._workers = []
+        self._idle = None
+        self._start_lock = asyncio.Lock()
+        self._next_job_id = 0
+        self.started = False
+        self.waiting = 0
+        self.recycled = 0
+        self.crashes = 0
+        self.timeouts = 0
+
+    def _command(self, worker):
+        """以模块方式启动子进程，使插件内的相对导入可用"""
+        package = __package__
+        if not package:
+            raise RuntimeError("渲染子进程需要以插件包的形式导入 render_worker")
+        root = os.path.dirname(os.path.abspath(__file__))
+        for _ in package.split('.'):
+            root = os.path.dirname(root)
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [root, env.get('PYTHONPATH')]))
+        env['PYTHONIOENCODING'] = 'utf-8'
+        options = dict(self.worker_options, worker_index=worker.index)
+        args = [sys.executable, '-m', f"{package}.render_worker", json.dumps(options)]
+        return args, env, root
+
+    async def start(self):
+        """拉起所有子进程并等待其浏览器就绪，重复调用无副作用"""
+        async with self._start_lock:
+            if self.started:
+                return
+            self._idle = asyncio.Queue()
+            self._workers = [_Worker(i) for i in range(self.size)]
+            try:
+                await asyncio.gather(*(self._spawn(worker) for worker in self._workers))
+            except Exception:
+                for worker in self._workers:
+                    await self._stop(worker)
+                self._workers = []
+                raise
+            for worker in self._workers:
+                self._idle.put_nowait(worker)
+            self.started = True
+            self.logger.info(f"渲染子进程已启动，共 {self.size} 个")
+
+    async def close(self):
+        async with self._start_lock:
+            if not self.started:
+                return
+            self.started = False
+            for worker in self._workers:
+                await self._stop(worker)
+            self._workers = []
+            self.logger.info("渲染子进程已全部关闭")
+
+    async def _spawn(self, worker):
+        spawn_start = time.time()
+        args, env, cwd = self._command(worker)
+        worker.process = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=env,
+            cwd=cwd,
+            limit=256 * 1024 * 1024  # 单行里带着整页截图
+        )
+        worker.jobs = 0
+        worker.pending = None
+        worker.ready = asyncio.get_event_loop().create_future()
+        worker.readers = [
+            asyncio.ensure_future(self._read_messages(worker)),
+            asyncio.ensure_future(self._read_logs(worker)),
+        ]
+        try:
+            await asyncio.wait_for(asyncio.shield(worker.ready), timeout=self.start_timeout)
+        except Exception:
+            await self._stop(worker)
+            raise
+        worker.started_at = time.time()
+        self.logger.info(f"渲染子进程 #{worker.index} (pid {worker.process.pid}) "
+                         f"启动耗时: {time.time() - spawn_start:.2f}秒")
+
+    async def _read_logs(self, worker):
+        while True:
+            line = await worker.process.stderr.readline()
+            if not line:
+                return
+            self.logger.info(f"[渲染子进程 #{worker.index}] {line.decode('utf-8', 'replace').rstrip()}")
+
+    async def _read_messages(self, worker):
+        process = worker.process
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            self._handle(worker, message)
+
+        # 管道关闭意味着子进程已经退出
+        await process.wait()
+        error = WorkerCrashed(f"渲染子进程 #{worker.index} 已退出，返回码 {process.returncode}")
+        if not worker.ready.done():
+            worker.ready.set_exception(error)
+        if worker.pending is not None and not worker.pending[1].done():
+            worker.pending[1].set_exception(error)
+
+    def _handle(self, worker, message):
+        kind = message.get('type')
+        if message.get('asset_cache') is not None:
+            worker.asset_cache = message['asset_cache']
+        if kind == 'ready':
+            if not worker.ready.done():
+                worker.ready.set_result(True)
+            return
+        if worker.pending is None or message.get('id') != worker.pending[0]:
+            return
+        job_id, future = worker.pending
+        if kind == 'claim':
+            ok = bool(worker.reuse_section and worker.reuse_section(message['hash']))
+            self._send(worker, {'type': 'claimed', 'id': job_id, 'hash': message['hash'], 'ok': ok})
+        elif kind == 'result' and not future.done():
+            future.set_result(_decode_result(message['result']))
+        elif kind == 'error' and not future.done():
+            if message.get('kind') == 'timeout':
+                future.set_exception(RenderTimeoutError(message['error']))
+            else:
+                future.set_exception(RuntimeError(message['error']))
+
+    def _send(self, worker, message):
+        worker.process.stdin.write((json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8'))
+
+    async def _stop(self, worker, graceful=True):
+        """先请求子进程自行退出，超时后连同浏览器进程一并杀掉"""
+        process = worker.process
+        if process is None:
+            return
+        descendants = process_descendants(process.pid) or set()
+        if process.returncode is None:
+            if graceful:
+                try:
+                    self._send(worker, {'type': 'shutdown'})
+                    await process.stdin.drain()
+                    await asyncio.wait_for(process.wait(), timeout=self.shutdown_timeout)
+                except (asyncio.TimeoutError, ConnectionError, OSError):
+                    pass
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+        # 子进程被强杀时，playwright 拉起的浏览器可能成为孤儿进程
+        for pid in descendants:
+            try:
+                os.kill(pid, signal.SIGKILL if hasattr(signal, 'SIGKILL') else signal.SIGTERM)
+            except OSError:
+                pass
+        for reader in worker.readers:
+            reader.cancel()
+        worker.readers = []
+        worker.process = None
+
+    async def _restart(self, worker, reason, graceful=True):
+        """在后台重启子进程，重启完成后才放回空闲队列"""
+        self.logger.info(f"重启渲染子进程 #{worker.index}: {reason}")
+        await self._stop(worker, graceful=graceful)
+        self.recycled += 1
+        while self.started:
+            try:
+                await self._spawn(worker)
+                break
+            except Exception as e:
+                self.logger.error(f"渲染子进程 #{worker.index} 启动失败，稍后重试: {e}")
+                await asyncio.sleep(5)
+        if self.started:
+            self._idle.put_nowait(worker)
+
+    def _rss(self, worker):
+        if not worker.alive:
+            return None
+        return process_tree_rss(worker.process.pid, include_root=True)
+
+    async def render(self, url, reuse_section=None, content_hash=None):
+        """在子进程中渲染页面，返回 (渲染结果, 流量统计)；结果格式与 PageRenderer.render 相同
+
+        reuse_section(hash) 在插件进程中被调用；content_hash 与页面内容哈希一致时子进程跳过截图。
+        """
+        if not self.started:
+            await self.start()
+
+        self.waiting += 1
+        try:
+            worker = await self._idle.get()
+        finally:
+            self.waiting -= 1
+
+        restart_reason = None
+        graceful = True
+        try:
+            if not worker.alive:
+                # 空闲期间退出的子进程在本次任务中直接重启
+                await self._stop(worker, graceful=False)
+                await self._spawn(worker)
+
+            self._next_job_id += 1
+            future = asyncio.get_event_loop().create_future()
+            worker.pending = (self._next_job_id, future)
+            worker.reuse_section = reuse_section
+            self._send(worker, {
+                'type': 'render',
+                'id': self._next_job_id,
+                'url': url,
+                'content_hash': content_hash,
+                'reuse_sections': reuse_section is not None,
+            })
+            await worker.process.stdin.drain()
+            try:
+                result = await asyncio.wait_for(future, timeout=self.job_timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                restart_reason, graceful = f"任务超过截止时间 {self.job_timeout} 秒", False
+                raise RenderTimeoutError(f"渲染子进程 #{worker.index} 超过截止时间 {self.job_timeout} 秒")
+            except WorkerCrashed:
+                self.crashes += 1
+                restart_reason, graceful = "子进程崩溃", False
+                raise
+            finally:
+                worker.pending = None
+                worker.reuse_section = None
+                worker.jobs += 1
+
+            rss = self._rss(worker)
+            if self.max_jobs and worker.jobs >= self.max_jobs:
+                restart_reason = f"已执行 {worker.jobs} 个任务"
+            elif self.max_rss_mb and rss is not None and rss > self.max_rss_mb * 1024 * 1024:
+                restart_reason = f"内存超过 {self.max_rss_mb}MB"
+            return result
+        except (ConnectionError, OSError) as e:
+            # 写入管道失败：子进程已经不在了
+            self.crashes += 1
+            restart_reason, graceful = "子进程管道已断开", False
+            raise WorkerCrashed(str(e))
+        finally:
+            if self.started:
+                if restart_reason is not None:
+                    asyncio.ensure_future(self._restart(worker, restart_reason, graceful=graceful))
+                else:
+                    self._idle.put_nowait(worker)
+
+    def asset_cache_stats(self):
+        """汇总各子进程最近一次上报的资源缓存条目数与大小"""
+        reports = [worker.asset_cache for worker in self._workers if worker.asset_cache]
+        return {
+            "entries": sum(report['entries'] for report in reports),
+            "bytes": sum(report['bytes'] for report in reports),
+        }
+
+    def rss_bytes(self):
+        """各子进程树的总常驻内存；需要扫描 /proc，可在线程池中调用"""
+        rss = [self._rss(worker) for worker in list(self._workers)]
+        known = [value for value in rss if value is not None]
+        return sum(known) if known else None
+
+    def stats(self, include_rss=True):
+        """返回子进程池的当前状态；include_rss 为 False 时不扫描进程内存"""
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize() if self._idle else 0,
+            "waiting": self.waiting,
+            "jobs": [worker.jobs for worker in self._workers],
+            "pids": [worker.process.pid if worker.alive else None for worker in self._workers],
+            "recycled": self.recycled,
+            "crashes": self.crashes,
+            "timeouts": self.timeouts,
+            "rss_bytes": self.rss_bytes() if include_rss else None,
+        }
+
+
+def main():
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format='%(levelname)s %(message)s')
+    options = json.loads(sys.argv[1]) if len(sys.argv) > 1 else {}
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    code = 0
+    try:
+        loop.run_until_complete(_WorkerServer(options).serve())
+    except Exception:
+        logging.exception("渲染子进程异常退出")
+        code = 1
+    finally:
+        loop.close()
+    # 读取 stdin 的线程仍阻塞在 read 上，直接退出，避免解释器关闭时卡住
+    sys.stderr.flush()
+    os._exit(code)
+
+
+if __name__ == "__main__":
+    main()
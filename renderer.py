@@ -0,0 +1,342 @@
+import time
+import logging
+import asyncio
+import hashlib
+import inspect
+
+
+# 让所有 section 提前合成，避免截图时出现未绘制的区块
+FORCE_COMPOSITE_JS = '''() => {
+    const sections = document.querySelectorAll('div.mon_body div.a_section');
+    sections.forEach(section => {
+        section.style.transform = 'translateZ(0)';
+        section.style.willChange = 'transform';
+        section.style.contain = 'paint';
+    });
+    document.body.offsetHeight;
+}'''
+
+# 隐藏顶部返回按钮
+HIDE_BACK_BUTTON_JS = '''() => {
+    const backSection = document.evaluate(
+        "/html/body/container/popbodyy/section[2]",
+        document,
+        null,
+        XPathResult.FIRST_ORDERED_NODE_TYPE,
+        null
+    ).singleNodeValue;
+    if (backSection) {
+        backSection.style.display = "none";
+    }
+}'''
+
+SECTIONS_INFO_JS = '''() => {
+    const body = document.querySelector('div.mon_body');
+    const sections = document.querySelectorAll('div.mon_body div.a_section');
+    return {
+        height: body ? body.scrollHeight : 0,
+        sectionsCount: sections.length
+    };
+}'''
+
+# 等待所有图片加载并解码完成，加载失败的图片直接忽略
+IMAGES_DECODED_JS = '''() => Promise.all(
+    Array.from(document.querySelectorAll('div.mon_body img')).map(img => {
+        const loaded = img.complete
+            ? Promise.resolve()
+            : new Promise(resolve => {
+                img.addEventListener('load', resolve, {once: true});
+                img.addEventListener('error', resolve, {once: true});
+            });
+        return loaded.then(() => img.decode ? img.decode().catch(() => {}) : null);
+    })
+).then(() => true)'''
+
+FONTS_READY_JS = '''() => document.fonts ? document.fonts.ready.then(() => true) : true'''
+
+CONTENT_BOX_JS = '''() => {
+    const content = document.querySelector("div.mon_body");
+    const rect = content.getBoundingClientRect();
+    return {
+        y: rect.top + window.scrollY,
+        height: rect.height
+    };
+}'''
+
+# 把内容区按区块切成首尾相接的横条：每条止于对应区块的底部，最后一条延伸到内容底部。
+# 文字与图片按所在位置归入横条，作为该横条的内容指纹
+SECTION_BANDS_JS = '''() => {
+    const body = document.querySelector('div.mon_body');
+    const rect = body.getBoundingClientRect();
+    const top = rect.top + window.scrollY;
+    const height = Math.round(rect.height);
+    const ends = [];
+    document.querySelectorAll('div.mon_body div.a_section').forEach(section => {
+        const bottom = Math.round(section.getBoundingClientRect().bottom + window.scrollY - top);
+        if (bottom > (ends.length ? ends[ends.length - 1] : 0) && bottom < height) {
+            ends.push(bottom);
+        }
+    });
+    ends.push(height);
+    const bands = ends.map((end, i) => ({y: i ? ends[i - 1] : 0, height: end - (i ? ends[i - 1] : 0), parts: []}));
+    const bandAt = y => {
+        const index = ends.findIndex(end => y < end);
+        return bands[index < 0 ? bands.length - 1 : index];
+    };
+
+    const range = document.createRange();
+    const walker = document.createTreeWalker(body, NodeFilter.SHOW_TEXT);
+    while (walker.nextNode()) {
+        const text = walker.currentNode.textContent.trim();
+        if (!text) continue;
+        range.selectNodeContents(walker.currentNode);
+        const box = range.getBoundingClientRect();
+        if (!box.height) continue;
+        bandAt(box.top + window.scrollY - top).parts.push(text);
+    }
+    body.querySelectorAll('img').forEach(img => {
+        const box = img.getBoundingClientRect();
+        if (!box.height) return;
+        bandAt(box.top + window.scrollY - top).parts.push('img:' + (img.currentSrc || img.src));
+    });
+
+    const styles = Array.from(document.querySelectorAll('link[rel="stylesheet"]')).map(link => link.href);
+    return {
+        y: top,
+        height: height,
+        styles: styles.join('|'),
+        bands: bands.map(band => ({y: band.y, height: band.height, text: band.parts.join('\\n')}))
+    };
+}'''
+
+# 内容指纹：内容区高度、可见文字、图片地址与样式表，任何一项变化都意味着截图可能不同
+CONTENT_FINGERPRINT_JS = '''() => {
+    const body = document.querySelector('div.mon_body');
+    const images = Array.from(body.querySelectorAll('img')).map(img => img.currentSrc || img.src);
+    const styles = Array.from(document.querySelectorAll('link[rel="stylesheet"]')).map(link => link.href);
+    return [Math.round(body.getBoundingClientRect().height), body.innerText, images.join('|'), styles.join('|')].join('\\n');
+}'''
+
+
+async def _call(callback, *args):
+    """回调既可以是普通函数，也可以返回可等待对象（如跨进程询问区块缓存）"""
+    result = callback(*args)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+class RenderTimeouts:
+    """各渲染阶段的超时时间（秒），overall 为整次渲染的硬性截止时间"""
+
+    def __init__(self, navigation=30, content=30, sections_stable=10, images=10,
+                 fonts=5, network_idle=5, screenshot=30, overall=90):
+        self.navigation = navigation
+        self.content = content
+        self.sections_stable = sections_stable
+        self.images = images
+        self.fonts = fonts
+        self.network_idle = network_idle
+        self.screenshot = screenshot
+        self.overall = overall
+
+
+class RenderTimeoutError(Exception):
+    """必需的渲染阶段超时"""
+
+
+class PageRenderer:
+    """单次加载页面，按真实的就绪信号等待后在同一页面内截图"""
+
+    CAPTURE_MODES = ('resize', 'full_page', 'sections')
+
+    def __init__(self, viewport_width=600, max_height=15000, timeouts=None,
+                 capture_mode='resize', stable_interval=0.25, stable_rounds=3,
+                 logger=None):
+        if capture_mode not in self.CAPTURE_MODES:
+            raise ValueError(f"不支持的截图模式: {capture_mode}")
+        self.logger = logger or logging.getLogger(__name__)
+        self.viewport_width = viewport_width
+        self.viewport_height = int(viewport_width * 16 / 9)  # 手机竖屏比例
+        self.max_height = max_height
+        self.timeouts = timeouts or RenderTimeouts()
+        self.capture_mode = capture_mode
+        self.stable_interval = stable_interval
+        self.stable_rounds = stable_rounds
+
+    async def render(self, context, url, reuse_section=None, unchanged=None):
+        """在给定的浏览器上下文中渲染页面，返回截图、内容哈希及各阶段耗时
+
+        sections 模式下不返回整页截图，而是返回 bands：每个横条的位置、内容哈希与截图；
+        reuse_section(hash) 返回 True 的横条不再截图，png 为 None，由调用方从缓存中取出。
+        unchanged(content_hash) 返回 True 时跳过截图，结果中 unchanged 为 True。
+        两个回调都可以是协程函数。
+        """
+        try:
+            return await asyncio.wait_for(
+                self._render(context, url, reuse_section, unchanged),
+                timeout=self.timeouts.overall
+            )
+        except asyncio.TimeoutError:
+            raise RenderTimeoutError(f"渲染超过总时限 {self.timeouts.overall} 秒")
+
+    async def _render(self, context, url, reuse_section=None, unchanged=None):
+        deadline = time.monotonic() + self.timeouts.overall
+        timings = {}
+
+        async def stage(name, coro_factory, timeout, required=False):
+            # 单阶段超时不超过剩余的总时限
+            remaining = max(0.0, deadline - time.monotonic())
+            stage_start = time.time()
+            try:
+                return await asyncio.wait_for(coro_factory(), timeout=min(timeout, remaining))
+            except asyncio.TimeoutError:
+                if required:
+                    raise RenderTimeoutError(f"阶段 {name} 超时")
+                self.logger.warning(f"阶段 {name} 超时，继续执行")
+                return None
+            finally:
+                timings[name] = time.time() - stage_start
+
+        page = await context.new_page()
+        await page.set_viewport_size({"width": self.viewport_width, "height": self.viewport_height})
+        await page.set_extra_http_headers({"Accept-Language": "zh-CN,zh;q=0.9"})
+
+        self.logger.info(f"正在加载页面: {url}")
+        await stage('navigation', lambda: page.goto(
+            url,
+            wait_until='domcontentloaded',
+            timeout=self.timeouts.navigation * 1000
+        ), self.timeouts.navigation, required=True)
+
+        await stage('content', lambda: page.wait_for_selector(
+            'div.mon_body',
+            state='visible',
+            timeout=self.timeouts.content * 1000
+        ), self.timeouts.content, required=True)
+
+        info = await stage('sections_stable', lambda: self._wait_sections_stable(page),
+                           self.timeouts.sections_stable)
+        if info is None:
+            info = await page.evaluate(SECTIONS_INFO_JS)
+        self.logger.info(f"计算得到总高度: {info['height']}px, 共 {info['sectionsCount']} 个区块")
+
+        if self.capture_mode in ('resize', 'sections'):
+            # 在同一页面中直接拉高视窗，使懒加载内容全部进入视口
+            await page.set_viewport_size({
+                "width": self.viewport_width,
+                "height": min(info['height'] + 1000, self.max_height)
+            })
+
+        await page.evaluate(FORCE_COMPOSITE_JS)
+        await stage('images', lambda: page.evaluate(IMAGES_DECODED_JS), self.timeouts.images)
+        await stage('fonts', lambda: page.evaluate(FONTS_READY_JS), self.timeouts.fonts)
+        await stage('network_idle', lambda: self._wait_network_idle(page), self.timeouts.network_idle)
+
+        await page.evaluate(HIDE_BACK_BUTTON_JS)
+        fingerprint = await page.evaluate(CONTENT_FINGERPRINT_JS)
+        content_hash = hashlib.sha1(f"{self.viewport_width}|{fingerprint}".encode('utf-8')).hexdigest()
+        if unchanged is not None and await _call(unchanged, content_hash):
+            await page.close()
+            return {
+                "screenshot": None,
+                "unchanged": True,
+                "content_hash": content_hash,
+                "width": self.viewport_width,
+                "sections": info['sectionsCount'],
+                "timings": timings,
+            }
+
+        if self.capture_mode == 'sections':
+            layout = await page.evaluate(SECTION_BANDS_JS)
+            bands = await stage('screenshot', lambda: self._capture_bands(page, layout, reuse_section),
+                                self.timeouts.screenshot, required=True)
+            await page.close()
+            return {
+                "screenshot": None,
+                "bands": bands,
+                "content_hash": content_hash,
+                "width": self.viewport_width,
+                "height": layout['height'],
+                "sections": info['sectionsCount'],
+                "timings": timings,
+            }
+
+        content_box = await page.evaluate(CONTENT_BOX_JS)
+        self.logger.info(f"内容区域高度: {content_box['height']}px")
+
+        screenshot = await stage('screenshot', lambda: self._capture(page, content_box),
+                                 self.timeouts.screenshot, required=True)
+        await page.close()
+
+        return {
+            "screenshot": screenshot,
+            "content_hash": content_hash,
+            "width": self.viewport_width,
+            "height": content_box['height'],
+            "sections": info['sectionsCount'],
+            "timings": timings,
+        }
+
+    async def _wait_sections_stable(self, page):
+        """轮询区块数量与高度，连续若干次不变即视为内容已稳定"""
+        last = None
+        stable = 0
+        while True:
+            info = await page.evaluate(SECTIONS_INFO_JS)
+            current = (info['sectionsCount'], info['height'])
+            if current == last and info['sectionsCount'] > 0:
+                stable += 1
+                if stable >= self.stable_rounds:
+                    return info
+            else:
+                stable = 0
+            last = current
+            await asyncio.sleep(self.stable_interval)
+
+    async def _wait_network_idle(self, page):
+        try:
+            await page.wait_for_load_state('networkidle', timeout=self.timeouts.network_idle * 1000)
+        except Exception:
+            # 网络空闲只是尽力而为的信号，超出预算时不影响截图
+            pass
+
+    async def _capture_bands(self, page, layout, reuse_section):
+        """逐个横条计算内容哈希，只截取未缓存的横条"""
+        bands = []
+        for band in layout['bands']:
+            if band['height'] <= 0:
+                continue
+            digest = hashlib.sha1(
+                f"{self.viewport_width}|{band['height']}|{layout['styles']}|{band['text']}".encode('utf-8')
+            ).hexdigest()
+            png = None
+            if reuse_section is None or not await _call(reuse_section, digest):
+                png = await page.screenshot(
+                    full_page=True,
+                    clip={
+                        "x": 0,
+                        "y": layout['y'] + band['y'],
+                        "width": self.viewport_width,
+                        "height": band['height']
+                    },
+                    timeout=self.timeouts.screenshot * 1000
+                )
+            bands.append({"hash": digest, "y": band['y'], "height": band['height'], "png": png})
+        return bands
+
+    async def _capture(self, page, content_box):
+        if self.capture_mode == 'full_page':
+            return await page.locator('div.mon_body').screenshot(
+                timeout=self.timeouts.screenshot * 1000
+            )
+        return await page.screenshot(
+            full_page=True,
+            clip={
+                "x": 0,
+                "y": content_box['y'],
+                "width": self.viewport_width,
+                "height": content_box['height']
+            },
+            timeout=self.timeouts.screenshot * 1000
+        )
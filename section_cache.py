@@ -0,0 +1,57 @@
+import time
+from .file_cache import IndexedFileCache
+
+
+class SectionCache(IndexedFileCache):
+    """按内容哈希缓存的区块截图（PNG），刷新时内容未变的区块直接复用"""
+
+    EVICTION_FIELD = 'used_at'
+    DESCRIPTION = '区块缓存'
+
+    def __init__(self, cache_dir, max_total_mb=256, pin_seconds=600, logger=None):
+        super().__init__(cache_dir, max_total_mb=max_total_mb, logger=logger)
+        # 最近用过的区块不参与淘汰，避免渲染过程中被删掉
+        self.pin_seconds = pin_seconds
+        self.captured = 0
+        self.reused = 0
+
+    def _path(self, key):
+        return super()._path(f"{key}.png")
+
+    def _pinned(self, entry):
+        return entry['used_at'] > time.time() - self.pin_seconds
+
+    def claim(self, key):
+        """区块已缓存时返回 True，并标记为刚刚使用过，保证本次渲染读取前不被淘汰"""
+        with self._lock:
+            entry = self.index.get(key)
+            if entry is None:
+                return False
+            entry['used_at'] = time.time()
+            return True
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                self.index.pop(key, None)
+            return None
+        with self._lock:
+            entry = self.index.get(key)
+            if entry is not None:
+                entry['used_at'] = time.time()
+        return data
+
+    def put(self, key, data):
+        self._put(key, data, {'size': len(data), 'used_at': time.time()})
+
+    def stats(self):
+        return {
+            "entries": len(self.index),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_total_bytes,
+            "captured": self.captured,
+            "reused": self.reused,
+        }
@@ -0,0 +1,75 @@
+import time
+from collections import OrderedDict
+
+
+def _payload_size(payload):
+    """分片快照的载荷是 base64 字符串的元组"""
+    if isinstance(payload, (list, tuple)):
+        return sum(len(part) for part in payload)
+    return len(payload)
+
+
+class SnapshotCache:
+    """已编码快照（base64 字符串或分片元组）的内存 LRU，按总字节数和 TTL 淘汰"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl_seconds=24 * 3600):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (payload, stored_at)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """取出未过期的载荷并标记为最近使用，未命中返回 None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        payload, stored_at = entry
+        if time.time() - stored_at > self.ttl_seconds:
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return payload
+
+    def put(self, key, payload, stored_at=None):
+        """写入载荷；stored_at 用于从磁盘回填时保留原始的生成时间"""
+        size = _payload_size(payload)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (payload, stored_at or time.time())
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        if key in self._entries:
+            self._remove(key)
+
+    def _remove(self, key):
+        payload, _ = self._entries.pop(key)
+        self.total_bytes -= _payload_size(payload)
+
+    def stats(self):
+        """命中/未命中/淘汰计数及当前占用"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -0,0 +1,338 @@
+import os
+import logging
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from contextlib import contextmanager
+from .file_cache import file_lock
+
+
+class SnapshotStore:
+    """磁盘快照存储：以角色ID为键的 JSON 清单，原子写入，按时间与总大小淘汰
+
+    同一目录可以被多个进程同时使用（例如运行中的插件与批量导出）：每次修改清单前都在
+    文件锁内重新读取磁盘上的清单，读取时发现清单被其他进程改动也会重新加载。
+    写入方在文件锁内修改清单的副本，完成后才替换 entries；读取方只在替换时短暂加锁，
+    不会等待其他进程持有的文件锁，可以在事件循环中调用。
+    """
+
+    MANIFEST_NAME = 'manifest.json'
+    LOCK_NAME = 'manifest.lock'
+    # 清单外的文件至少要比清单加载时间早这么久才视为孤立文件
+    ORPHAN_GRACE_SECONDS = 600
+
+    def __init__(self, root_dir, extension='.jpg', max_total_mb=512, max_age_days=7,
+                 eviction_interval=3600, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.root_dir = root_dir
+        self.extension = extension
+        self.max_total_bytes = max_total_mb * 1024 * 1024 if max_total_mb else None
+        self.max_age_days = max_age_days
+        self.eviction_interval = eviction_interval
+        self.manifest_path = os.path.join(root_dir, self.MANIFEST_NAME)
+        self.lock_path = os.path.join(root_dir, self.LOCK_NAME)
+        # _lock 只保护 entries 与 _changed 的替换，持有期间不做任何 IO；
+        # _write_lock 让本进程的写入方依次进入文件锁
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._eviction_task = None
+        self.evicted = 0
+        # 当前 entries 对应的清单文件版本 (mtime_ns, size)，以及 entries 被替换的次数
+        self._manifest_stamp = None
+        self._version = 0
+        self._changed = set()
+        os.makedirs(root_dir, exist_ok=True)
+        self.entries, self._manifest_stamp = self._load_manifest()
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load_manifest(self):
+        """读取磁盘上的清单，返回 (条目, 文件版本)；先取版本再读内容，读取期间被改写时下次会重新加载"""
+        stamp = self._stamp()
+        if stamp is None:
+            return {}, None
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('entries', {}), stamp
+        except Exception as e:
+            self.logger.warning(f"读取快照清单失败，将重新建立: {e}")
+            return {}, stamp
+
+    def _swap_entries(self, entries, stamp, since_version=None, external=True):
+        """替换 entries；external 为 True 时记录图片内容有变化的角色ID。since_version 之后已被替换过时放弃"""
+        with self._lock:
+            if since_version is not None and self._version != since_version:
+                return
+            if external:
+                previous = self.entries
+                self._changed.update(
+                    character_id for character_id, entry in entries.items()
+                    if previous.get(character_id, {}).get('sha256') != entry.get('sha256')
+                )
+            self.entries = entries
+            self._manifest_stamp = stamp
+            self._version += 1
+
+    @contextmanager
+    def _manifest_lock(self):
+        """写入方的互斥：在文件锁内重新读取清单，产出可修改的条目副本
+
+        调用方修改后通过 _save_manifest(entries) 写回；退出时才替换 entries，
+        读取方在此期间继续使用旧的条目。会阻塞等待其他进程，只能在线程池中调用。
+        """
+        with self._write_lock, file_lock(self.lock_path):
+            entries, stamp = self._load_manifest()
+            # 其他进程的改动先合入 entries（交给读取方的是副本），让内存缓存能据此失效
+            self._swap_entries({key: dict(entry) for key, entry in entries.items()}, stamp)
+            yield entries
+            # 本进程自己的写入，内存缓存由调用方维护，不计入 take_changed()
+            self._swap_entries(entries, self._stamp(), external=False)
+
+    def _save_manifest(self, entries):
+        self._atomic_write(self.manifest_path, json.dumps(
+            {'entries': entries}, ensure_ascii=False
+        ).encode('utf-8'))
+
+    def refresh(self):
+        """清单被其他进程改动时重新加载，图片内容有变化的角色ID记入 take_changed() 的结果
+
+        只做 stat 与读取清单，不等待文件锁，可以在事件循环中调用。
+        """
+        with self._lock:
+            version, current = self._version, self._manifest_stamp
+        if self._stamp() == current:
+            return
+        entries, stamp = self._load_manifest()
+        self._swap_entries(entries, stamp, since_version=version)
+
+    def take_changed(self):
+        """返回并清空自上次调用以来被其他进程改写过图片的角色ID集合"""
+        self.refresh()
+        with self._lock:
+            changed, self._changed = self._changed, set()
+        return changed
+
+    def _atomic_write(self, path, data):
+        """先写临时文件再 rename，读者永远不会看到写了一半的文件"""
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _path(self, entry):
+        return os.path.join(self.root_dir, entry['file'])
+
+    @staticmethod
+    def _files(entry):
+        """条目占用的全部文件；分片快照每片一个文件"""
+        return entry.get('slices') or [entry['file']]
+
+    def entry(self, character_id):
+        self.refresh()
+        return self.entries.get(str(character_id))
+
+    def rendered_at(self, character_id):
+        entry = self.entry(character_id)
+        return entry['rendered_at'] if entry else None
+
+    @staticmethod
+    def fresh_since(entry):
+        """快照最近一次被确认有效的时间：重新渲染或内容探测未发现变化时更新"""
+        return entry.get('verified_at') or entry['rendered_at']
+
+    def touch(self, character_id):
+        """内容未变化时延长快照有效期，不改动图片文件；条目不存在时返回 None"""
+        with self._manifest_lock() as entries:
+            entry = entries.get(str(character_id))
+            if entry is None:
+                return None
+            entry['verified_at'] = time.time()
+            self._save_manifest(entries)
+            return entry
+
+    def get(self, character_id, max_age_seconds=None):
+        """读取未过期的快照，返回 (图片字节, 清单条目)，不存在或过期时返回 None"""
+        entry = self.entry(character_id)
+        if entry is None:
+            return None
+        if entry.get('slices') or self._expired(entry, max_age_seconds):
+            return None
+        try:
+            with open(self._path(entry), 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            self.logger.warning(f"读取快照文件失败: {e}")
+            return None
+        return data, entry
+
+    def get_slices(self, character_id, max_age_seconds=None):
+        """读取未过期的分片快照，返回 (各分片字节列表, 清单条目)，不是分片快照时返回 None"""
+        entry = self.entry(character_id)
+        if entry is None or not entry.get('slices') or self._expired(entry, max_age_seconds):
+            return None
+        slices = []
+        try:
+            for filename in entry['slices']:
+                with open(os.path.join(self.root_dir, filename), 'rb') as f:
+                    slices.append(f.read())
+        except OSError as e:
+            self.logger.warning(f"读取快照分片失败: {e}")
+            return None
+        return slices, entry
+
+    @staticmethod
+    def _expired(entry, max_age_seconds):
+        return max_age_seconds is not None and time.time() - SnapshotStore.fresh_since(entry) > max_age_seconds
+
+    def put(self, character_id, data, name=None, rendered_at=None, **extra):
+        """原子写入快照并更新清单，返回新的清单条目"""
+        character_id = str(character_id)
+        entry = {
+            'file': f'{character_id}{self.extension}',
+            'name': name,
+            'rendered_at': rendered_at or time.time(),
+            'size': len(data),
+            'sha256': hashlib.sha256(data).hexdigest(),
+        }
+        entry.update(extra)
+        with self._manifest_lock() as entries:
+            self._atomic_write(self._path(entry), data)
+            entries[character_id] = entry
+            self._save_manifest(entries)
+        return entry
+
+    def put_slices(self, character_id, slices, name=None, rendered_at=None, **extra):
+        """写入各个分片并更新清单，返回新的清单条目
+
+        每次写入都使用新的文件名，写完后才一次性替换清单条目，并发读取旧条目的读者
+        只会读到完整的旧快照或完整的新快照；旧分片留给后台淘汰清理。
+        """
+        character_id = str(character_id)
+        generation = f'{time.time_ns():x}'
+        files = [f'{character_id}_{generation}_{index}{self.extension}' for index in range(len(slices))]
+        entry = {
+            'file': files[0],
+            'slices': files,
+            'name': name,
+            'rendered_at': rendered_at or time.time(),
+            'size': sum(len(data) for data in slices),
+            'sha256': [hashlib.sha256(data).hexdigest() for data in slices],
+        }
+        entry.update(extra)
+        with self._manifest_lock() as entries:
+            for filename, data in zip(files, slices):
+                self._atomic_write(os.path.join(self.root_dir, filename), data)
+            entries[character_id] = entry
+            self._save_manifest(entries)
+        return entry
+
+    def remove(self, character_id):
+        with self._manifest_lock() as entries:
+            entry = entries.pop(str(character_id), None)
+            if entry is not None:
+                for filename in self._files(entry):
+                    self._remove_file(filename)
+                self._save_manifest(entries)
+
+    def _remove_file(self, filename):
+        try:
+            os.remove(os.path.join(self.root_dir, filename))
+        except FileNotFoundError:
+            pass
+
+    @property
+    def total_bytes(self):
+        return sum(entry['size'] for entry in self.entries.values())
+
+    def evict(self):
+        """淘汰超龄快照，总大小超限时从最旧的开始删除，同时清理清单外的孤立文件
+
+        孤立文件只清理早于本次加载清单的，其他进程刚写入、尚未登记到清单的文件不受影响。
+        """
+        removed = 0
+        with self._manifest_lock() as entries:
+            # 清单刚在锁内重新读取，此前写入的文件若未登记且超过宽限期即为孤立文件
+            loaded_at = now = time.time()
+            if self.max_age_days:
+                max_age = self.max_age_days * 86400
+                for character_id, entry in list(entries.items()):
+                    if now - self.fresh_since(entry) > max_age:
+                        del entries[character_id]
+                        for filename in self._files(entry):
+                            self._remove_file(filename)
+                        removed += 1
+
+            if self.max_total_bytes:
+                total = sum(entry['size'] for entry in entries.values())
+                for character_id, entry in sorted(entries.items(),
+                                                  key=lambda item: self.fresh_since(item[1])):
+                    if total <= self.max_total_bytes:
+                        break
+                    del entries[character_id]
+                    for filename in self._files(entry):
+                        self._remove_file(filename)
+                    total -= entry['size']
+                    removed += 1
+
+            known = {filename for entry in entries.values() for filename in self._files(entry)}
+            known.update((self.MANIFEST_NAME, self.LOCK_NAME))
+            for filename in os.listdir(self.root_dir):
+                if filename in known:
+                    continue
+                try:
+                    mtime = os.path.getmtime(os.path.join(self.root_dir, filename))
+                except OSError:
+                    continue
+                # 跳过其他进程正在写入的临时文件，以及加载清单前后不久才写入、可能尚未登记的文件
+                if mtime >= loaded_at - self.ORPHAN_GRACE_SECONDS:
+                    continue
+                self._remove_file(filename)
+                removed += 1
+
+            if removed:
+                self._save_manifest(entries)
+        self.evicted += removed
+        return removed
+
+    def start_eviction(self):
+        """启动后台淘汰任务"""
+        if self._eviction_task is None or self._eviction_task.done():
+            self._eviction_task = asyncio.ensure_future(self._eviction_loop())
+
+    async def stop_eviction(self):
+        if self._eviction_task is None:
+            return
+        self._eviction_task.cancel()
+        try:
+            await self._eviction_task
+        except asyncio.CancelledError:
+            pass
+        self._eviction_task = None
+
+    async def _eviction_loop(self):
+        while True:
+            try:
+                removed = await asyncio.get_event_loop().run_in_executor(None, self.evict)
+                if removed:
+                    self.logger.info(f"已淘汰 {removed} 个快照文件")
+            except Exception as e:
+                self.logger.error(f"淘汰快照时出错: {e}")
+            await asyncio.sleep(self.eviction_interval)
+
+    def stats(self):
+        self.refresh()
+        return {
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_total_bytes,
+            "evicted": self.evicted,
+        }